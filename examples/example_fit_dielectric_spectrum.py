@@ -28,7 +28,7 @@ omegas    = concatenate((logspace(log10(min_freq),log10(mid_freq),150),linspace(
 n      = data[0:maxw,1]
 k      = data[0:maxw,2]
 
-rawrp = n**2 + k**2
+rawrp = n**2 - k**2 #eps = (n + ik)**2, as load_spectrum converts .RI files
 rawcp = 2*n*k
 
 rp = interp(omegas,rawomegas,rawrp)
@@ -27,7 +27,7 @@ mid_freq  = 18
 omegas    = rawomegas #concatenate((logspace(log10(min_freq),log10(mid_freq),30),linspace(mid_freq,max_freq,80)))
 n     = eps_data[0:maxw,1]
 k     = eps_data[0:maxw,2]
-rawrp = n**2 + k**2
+rawrp = n**2 - k**2 #eps = (n + ik)**2, as load_spectrum converts .RI files
 rawcp = 2*n*k
 
 rp = rawrp #interp(omegas,rawomegas,rawrp)
@@ -23,6 +23,8 @@ setup(name='spectrumfitter',
 	],
       license='MIT',
       install_requires=['numpy', 'matplotlib', 'scipy'],
+      extras_require={'hdf5': ['h5py']},
       packages=find_packages(),
+      entry_points={'console_scripts': ['spectrumfitter=spectrumfitter.cli:main']},
       zip_safe=False)
 
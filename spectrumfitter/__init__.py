@@ -10,5 +10,15 @@
 
 from .spectrumfitter import *
 from .spectralmodel import SpectralModel
+from .uncertainties import bootstrap, BootstrapResult
+from .fitcache import FitCache
+from .modelspec import model_from_spec, model_to_spec
+from .scheduler import FitScheduler, FitCancelled
+from .globalfit import GlobalFit
+from .seriesfit import SeriesFit
+from .constraints import FSumConstraint, GLSTConstraint
+from .modelselect import select_model, SelectionResult
+from .streaming import watch_directory, tail_file, refit_stream
+from .surrogate import surrogate_minimize
 
-__all__ = ['spectrumfitter','spectralmodel']
\ No newline at end of file
+__all__ = ['spectrumfitter','spectralmodel','uncertainties','fitcache','modelspec','scheduler','globalfit','seriesfit','constraints','modelselect','streaming','surrogate']
\ No newline at end of file
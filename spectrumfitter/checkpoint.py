@@ -0,0 +1,120 @@
+''' checkpoint.py : periodic checkpoints so long fits can be resumed after the process is killed '''
+from numpy import *
+import os
+import pickle
+import tempfile
+from scipy import optimize
+from scipy.optimize._differentialevolution import DifferentialEvolutionSolver
+
+_DE_STATE_KEYS = ['population', 'population_energies', 'feasible', 'constraint_violation', 'population_index', 'nfev', 'rng_state', 'nit']
+
+
+def dump_atomic(obj, fname, prefix=".tmp-"):
+    '''pickle obj to fname through a temporary file in the same directory that is renamed into place, so a
+    crash mid-write never leaves a corrupt file and concurrent readers never see a partial one'''
+    dirname = os.path.dirname(os.path.abspath(fname))
+    (fd, tmpname) = tempfile.mkstemp(dir=dirname, prefix=prefix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, fname)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+
+
+def save_checkpoint(fname, state):
+    '''write a checkpoint dictionary to fname atomically, so a crash mid-write never leaves a corrupt file'''
+    dump_atomic(state, fname, prefix=".checkpoint-")
+
+
+def load_checkpoint(fname, bounds=None, fingerprint=None):
+    '''read a checkpoint written by save_checkpoint. Returns None if there is no checkpoint file.
+
+    If bounds are given they must match the bounds stored in the checkpoint, which guards against
+    resuming a fit of a different model. If a fingerprint is given (eg. fitcache.fit_key of the data, model,
+    starting parameters and options) it must match the one stored by new_state, which guards against
+    resuming, or returning the result of, a fit of different data or with different options.
+    '''
+    if not os.path.exists(fname):
+        return None
+    with open(fname, 'rb') as f:
+        state = pickle.load(f)
+    if (bounds is not None) and (state['bounds'] != [tuple(b) for b in bounds]):
+        raise ValueError("checkpoint %s was written for a model with different bounds" % fname)
+    if (fingerprint is not None) and (state.get('fingerprint') != fingerprint):
+        raise ValueError("checkpoint %s was written for a different fit (data, starting parameters or options)" % fname)
+    return state
+
+
+def new_state(params, bounds, fingerprint=None):
+    '''checkpoint state at the very start of a fit; fingerprint identifies the fit (see load_checkpoint)'''
+    return {'stage': 0, 'params': list(params), 'bounds': [tuple(b) for b in bounds], 'fingerprint': fingerprint}
+
+
+def differential_evolution(costfun, bounds, maxiter=2000, seed=None, state=None, checkpoint=None, checkpoint_every=10, callback=None):
+    '''scipy.optimize.differential_evolution with periodic checkpoints of the population and RNG state
+
+    Without a checkpoint file, or a population to continue from, this simply calls optimize.differential_evolution.
+    Otherwise the solver object is driven directly, because an exact restart also needs its internal sample
+    index permutation, which the public interface does not expose; only this opt-in path depends on scipy
+    internals.
+
+    args:
+        costfun, bounds, maxiter: as for scipy.optimize.differential_evolution
+        seed: integer seed for the random number generator
+        state: a checkpoint state; if it holds a DE population the run continues from that generation
+        checkpoint: file name to write checkpoints to (None = no checkpoints)
+        checkpoint_every: write a checkpoint every this many generations
+        callback: optional function called as callback('differential_evolution', best params, best cost) after every generation
+    returns:
+        the OptimizeResult from scipy, with nit counting the generations from before the restart
+    '''
+    if state is None:
+        state = {}
+
+    if (checkpoint is None) and ('population' not in state):
+        def public_callback(intermediate_result):
+            callback('differential_evolution', list(intermediate_result.x), float(intermediate_result.fun))
+        return optimize.differential_evolution(costfun, bounds, maxiter=maxiter, seed=seed,
+                                               callback=None if (callback is None) else public_callback)
+
+    rng = random.RandomState(seed)
+    nit0 = 0
+
+    def de_callback(intermediate_result):
+        nit = nit0 + intermediate_result.nit
+        if (checkpoint is not None) and (nit % checkpoint_every == 0):
+            state['population'] = array(solver.population)
+            state['population_energies'] = array(solver.population_energies)
+            state['feasible'] = array(solver.feasible)
+            state['constraint_violation'] = array(solver.constraint_violation)
+            state['population_index'] = array(solver._random_population_index)
+            state['nfev'] = solver._nfev
+            state['rng_state'] = rng.get_state()
+            state['nit'] = nit
+            state['params'] = list(intermediate_result.x)
+            save_checkpoint(checkpoint, state)
+        if (callback is not None):
+            callback('differential_evolution', list(intermediate_result.x), float(intermediate_result.fun))
+
+    #positional arguments: the name of the RNG argument differs between scipy versions (seed/rng)
+    solver = DifferentialEvolutionSolver(costfun, bounds, (), 'best1bin', maxiter, 15, 0.01, (0.5, 1), 0.7, rng, callback=de_callback)
+    with solver:
+        if ('population' in state):
+            nit0 = state['nit']
+            rng.set_state(state['rng_state'])
+            solver.population = state['population']
+            solver.population_energies = state['population_energies']
+            solver.feasible = state['feasible']
+            solver.constraint_violation = state['constraint_violation']
+            solver._random_population_index = state['population_index']
+            solver._nfev = state['nfev']
+            solver.maxiter = maxiter - nit0
+        resultobject = solver.solve()
+    resultobject.nit = nit0 + resultobject.nit
+
+    for key in _DE_STATE_KEYS:
+        state.pop(key, None)
+    return resultobject
@@ -0,0 +1,103 @@
+''' cli.py : the spectrumfitter command, batch fitting of data files against a model specification file '''
+import argparse
+import io
+import json
+import os
+import sys
+from contextlib import redirect_stdout
+from multiprocessing import Pool
+from .spectrumfitter import load_spectrum
+from .modelspec import load_model_spec, check_model_spec, model_from_spec, model_to_spec
+
+
+def fit_file(args):
+    '''fit the model described by spec to one data file. Returns a dictionary describing the result.
+
+    Any exception is caught and reported in the "error" entry so that one bad file does not stop a batch.
+    '''
+    (spec, fname, fit_options) = args
+    try:
+        model = model_from_spec(spec)
+        (omegas, rp, cp) = load_spectrum(fname, **spec.get("data", {}))
+        options = dict(spec.get("fit", {}))
+        options.update(fit_options)
+        model.fit_model(omegas, rp, cp, verbose=False, **options)
+
+        report = io.StringIO()
+        with redirect_stdout(report):
+            print(fname)
+            model.print_model()
+
+        result = model_to_spec(model)
+        result.update({"file": fname, "RMS_error": float(model.RMS_error), "fsum": float(model.fsum()), "fit_report": model.fit_report})
+        return (result, report.getvalue())
+    except Exception as e:
+        return ({"file": fname, "error": "%s: %s" % (type(e).__name__, e)}, None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="spectrumfitter",
+                                     description="Fit a model specification (JSON) to one or more spectrum files. "
+                                                 "A JSON line is written to stdout as each fit finishes.")
+    parser.add_argument("model", help="JSON model specification file")
+    parser.add_argument("data", nargs="+", help="spectrum files (.RI, or columns of frequency, real part, complex part)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of fits to run in parallel (default 1)")
+    parser.add_argument("-o", "--output", help="also write the JSON lines to this file")
+    parser.add_argument("--report-dir", help="write a text report for every data file into this directory at the end")
+    parser.add_argument("--cache", help="directory of a fit cache to reuse identical fits from")
+    parser.add_argument("--seed", type=int, help="seed for differential evolution")
+    parser.add_argument("--no-de", action="store_true", help="skip the differential evolution stage")
+    args = parser.parse_args(argv)
+
+    spec = load_model_spec(args.model)
+    try:
+        check_model_spec(spec) #once, rather than failing the same way for every file
+    except ValueError as e:
+        print("invalid model specification %s: %s" % (args.model, e), file=sys.stderr)
+        return 2
+    fit_options = {}
+    if (args.cache is not None): fit_options["cache"] = args.cache
+    if (args.seed is not None): fit_options["seed"] = args.seed
+    if (args.no_de == True): fit_options["differential_evolution"] = False
+
+    tasks = [(spec, fname, fit_options) for fname in args.data]
+    output = open(args.output, "w") if (args.output is not None) else None
+    reports = {}
+    failed = 0
+
+    pool = Pool(args.jobs) if (args.jobs > 1) else None
+    try:
+        results = pool.imap_unordered(fit_file, tasks) if (pool is not None) else map(fit_file, tasks)
+        for (result, report) in results:
+            line = json.dumps(result)
+            print(line)
+            sys.stdout.flush()
+            if (output is not None):
+                output.write(line + "\n")
+                output.flush()
+            if ("error" in result):
+                failed += 1
+            else:
+                reports[result["file"]] = report
+    finally:
+        if (pool is not None):
+            pool.close()
+            pool.join()
+        if (output is not None):
+            output.close()
+
+    if (args.report_dir is not None):
+        os.makedirs(args.report_dir, exist_ok=True)
+        for fname in args.data:
+            if fname in reports:
+                with open(os.path.join(args.report_dir, os.path.basename(fname) + ".txt"), "w") as f:
+                    f.write(reports[fname])
+
+    if (failed > 0):
+        print("%d of %d fits failed" % (failed, len(args.data)), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+''' constraints.py : physical constraints (f-sum rule, gLST relation) for the constrained optimizers
+
+A constraint acts on the flat parameter vector that is being optimized. For fits of a single model this is
+model.getparams(); for joint fits the offset argument says where a model's parameters start in the vector.
+
+Constraints are passed to SLSQP and trust-constr as real equality/inequality constraints with analytic
+Jacobians. The stages that cannot handle constraints (differential evolution, TNC) evaluate the cost at a
+repaired, feasible point instead (see Constraint.repair).
+'''
+from numpy import *
+from scipy import optimize
+from abc import ABC, abstractmethod
+
+
+class Constraint(ABC):
+    """Base class. Subclasses define fun(params) (zero when satisfied for type 'eq', >= 0 when satisfied for
+    type 'ineq') and its gradient jac(params), and can define repair(params, bounds)"""
+    type = 'eq'
+
+    @abstractmethod
+    def fun(self, params):
+        pass
+
+    @abstractmethod
+    def jac(self, params):
+        pass
+
+    def repair(self, params, bounds):
+        '''return params moved to (or towards) the feasible set, staying within bounds'''
+        return params
+
+    def violation(self, params):
+        '''how far params is from satisfying the constraint (0 when it is satisfied)'''
+        value = self.fun(params)
+        if (self.type == 'eq'):
+            return abs(value)
+        return maximum(-value, 0)
+
+    def as_dict(self):
+        '''the constraint in the dictionary form used by SLSQP'''
+        return {'type': self.type, 'fun': lambda x: self.fun(x), 'jac': lambda x: self.jac(x)}
+
+    def as_nonlinear(self):
+        '''the constraint as a NonlinearConstraint for trust-constr'''
+        upper = 0 if (self.type == 'eq') else inf
+        return optimize.NonlinearConstraint(lambda x: self.fun(x), 0, upper, jac=lambda x: atleast_2d(self.jac(x)))
+
+
+class FSumConstraint(Constraint):
+    """f-sum rule: the sum of the oscillator strengths of model equals target (eg. the static dielectric constant)
+
+    args:
+        model: the SpectralModel whose strengths are summed (see SpectralModel.fsum)
+        target: the required value of the sum
+        offset: position of the model's first parameter in the optimized vector
+        type: 'eq' for fsum == target, 'ineq' for fsum <= target
+    """
+    def __init__(self, model, target, offset=0, type='eq'):
+        self.indices = offset + model.strength_indices()
+        self.target = float(target)
+        self.offset = offset
+        self.type = type
+
+    def __repr__(self):
+        return "FSumConstraint(target=%r, offset=%r, type=%r)" % (self.target, self.offset, self.type)
+
+    def fun(self, params):
+        value = asarray(params, dtype=float)[self.indices].sum() - self.target
+        return value if (self.type == 'eq') else -value
+
+    def jac(self, params):
+        J = zeros(len(params))
+        J[self.indices] = 1.0 if (self.type == 'eq') else -1.0
+        return J
+
+    def repair(self, params, bounds):
+        '''shift the strengths by the missing amount, shared out in proportion to the room left within their bounds'''
+        x = array(params, dtype=float)
+        deficit = self.target - x[self.indices].sum()
+        if (deficit == 0) or ((self.type == 'ineq') and (deficit > 0)):
+            return x
+        lo = array([bounds[i][0] for i in self.indices], dtype=float)
+        hi = array([bounds[i][1] for i in self.indices], dtype=float)
+        room = (hi - x[self.indices]) if (deficit > 0) else (x[self.indices] - lo)
+        room = clip(where(isfinite(room), room, abs(deficit)), 0, None)
+        total = room.sum()
+        if (total <= 0):
+            return x
+        x[self.indices] = clip(x[self.indices] + sign(deficit)*minimum(abs(deficit), total)*room/total, lo, hi)
+        return x
+
+
+class GLSTConstraint(Constraint):
+    """generalized Lyddane-Sachs-Teller relation between a longitudinal and a transverse model:
+    gLST_LHS(modelL, modelT) == target (normally eps(0)/eps(inf))
+
+    It is imposed in logarithmic form, log(LHS) - log(target) = 0, which keeps the Jacobian well scaled:
+    d/dx log(x) for the Debye relaxation frequencies and d/dw log(w**2 + gamma**2) for the oscillators.
+
+    args:
+        modelL, modelT: the longitudinal and transverse SpectralModels
+        target: the required value of the left hand side
+        offsetL, offsetT: positions of each model's first parameter in the optimized vector
+    """
+    def __init__(self, modelL, modelT, target, offsetL=0, offsetT=0):
+        (relax, osc) = modelL.glst_indices()
+        self.Lrelax = offsetL + relax
+        self.Losc = offsetL + osc
+        (relax, osc) = modelT.glst_indices()
+        self.Trelax = offsetT + relax
+        self.Tosc = offsetT + osc
+        self.target = float(target)
+        self.offsets = (offsetL, offsetT)
+
+    def __repr__(self):
+        return "GLSTConstraint(target=%r, offsets=%r)" % (self.target, self.offsets)
+
+    def fun(self, params):
+        x = asarray(params, dtype=float)
+        Lw = x[self.Losc[:,0]]
+        Lg = x[self.Losc[:,1]]
+        Tw = x[self.Tosc[:,0]]
+        return (log(x[self.Lrelax]).sum() + log(Lw**2 + Lg**2).sum()
+                - log(x[self.Trelax]).sum() - log(Tw**2).sum() - log(self.target))
+
+    def jac(self, params):
+        x = asarray(params, dtype=float)
+        J = zeros(len(x))
+        Lw = x[self.Losc[:,0]]
+        Lg = x[self.Losc[:,1]]
+        J[self.Lrelax] += 1/x[self.Lrelax]
+        J[self.Losc[:,0]] += 2*Lw/(Lw**2 + Lg**2)
+        J[self.Losc[:,1]] += 2*Lg/(Lw**2 + Lg**2)
+        J[self.Trelax] -= 1/x[self.Trelax]
+        J[self.Tosc[:,0]] -= 2/x[self.Tosc[:,0]]
+        return J
+
+    def repair(self, params, bounds):
+        '''scale all longitudinal frequencies by the common factor that satisfies the relation (clipped to bounds)'''
+        x = array(params, dtype=float)
+        idx = concatenate((self.Lrelax, self.Losc[:,0], self.Losc[:,1]))
+        npower = len(self.Lrelax) + 2*len(self.Losc)
+        if (npower == 0) or any(x[idx] <= 0):
+            return x
+        x[idx] = x[idx]*exp(-self.fun(x)/npower)
+        lo = array([bounds[i][0] for i in idx], dtype=float)
+        hi = array([bounds[i][1] for i in idx], dtype=float)
+        x[idx] = clip(x[idx], lo, hi)
+        return x
+
+
+def repair(constraints, params, bounds):
+    '''apply the repair of every constraint in turn'''
+    x = array(params, dtype=float)
+    for c in constraints:
+        x = c.repair(x, bounds)
+    return x
+
+
+def checked_result(resultobject, x0, constraints, bounds, costfun, tol=1e-6):
+    """the point to continue from after a constrained optimizer (SLSQP, trust-constr) started at x0
+
+    The result is taken as it is if the optimizer succeeded and it satisfies every constraint to within tol.
+    Otherwise the result is repaired, and if that still violates a constraint, or costs more than the repaired
+    starting point, the repaired starting point is used instead.
+
+    returns:
+        (params, message), where message is None when the result was accepted and otherwise says what went wrong
+    """
+    x = array(resultobject.x, dtype=float)
+    violation = max([0.0] + [float(c.violation(x)) for c in constraints])
+    if resultobject.success and (violation <= tol):
+        return (x, None)
+    message = resultobject.message if not resultobject.success else "the result violates the constraints by %g" % violation
+    x = repair(constraints, x, bounds)
+    start = repair(constraints, x0, bounds)
+    if (max([0.0] + [float(c.violation(x)) for c in constraints]) > tol) or (costfun(list(x)) > costfun(list(start))):
+        return (start, "%s; kept the starting point" % message)
+    return (x, "%s; kept the repaired result" % message)
@@ -0,0 +1,117 @@
+''' fitcache.py : content-addressed on-disk cache of fit results '''
+from numpy import *
+import hashlib
+import os
+import pickle
+import scipy
+from .checkpoint import dump_atomic
+
+CACHE_FORMAT = 1
+
+
+def model_signature(model):
+    '''hash of the structure of a model: the class, type and name of each lineshape and its number of parameters'''
+    h = hashlib.sha256()
+    for lineshape in model.lineshapes:
+        h.update(repr((type(lineshape).__name__, getattr(lineshape, "type", None), lineshape.name, len(lineshape.p))).encode())
+    return h.hexdigest()[0:16]
+
+
+#fit_model options that do not change the result of a fit
+NEUTRAL_OPTIONS = ('verbose', 'callback', 'cache', 'checkpoint', 'checkpoint_every', 'resume')
+
+
+def setup_signature(model, options={}):
+    '''hash of everything apart from the data and starting parameters that decides the result of a fit: the
+    model structure, its bounds and the fit_model options (except those in NEUTRAL_OPTIONS)'''
+    h = hashlib.sha256()
+    h.update(model_signature(model).encode())
+    h.update(repr([(float(lo), float(hi)) for (lo, hi) in model.getbounds()]).encode())
+    h.update(repr(sorted([(k, v) for (k, v) in options.items() if k not in NEUTRAL_OPTIONS])).encode())
+    return h.hexdigest()[0:16]
+
+
+def fit_key(model, dataX, datarp, datacp, options):
+    '''key identifying a fit: hash of the data arrays, model structure, initial parameters, bounds and fit options'''
+    h = hashlib.sha256()
+    h.update(repr((CACHE_FORMAT, scipy.__version__)).encode())
+    for data in (dataX, datarp, datacp):
+        h.update(ascontiguousarray(data, dtype=float64).tobytes())
+    h.update(model_signature(model).encode())
+    h.update(repr([float(x) for x in model.getparams()]).encode())
+    h.update(repr([(float(lo), float(hi)) for (lo, hi) in model.getbounds()]).encode())
+    h.update(repr(sorted(options.items())).encode())
+    return h.hexdigest()
+
+
+class FitCache:
+    """A directory of pickled fit results, one file per key, with least-recently-used eviction
+
+    Entries are written to a temporary file and renamed into place, so concurrent writers (eg. workers in a
+    process pool) never see partial files; eviction tolerates entries vanishing under it.
+
+    args:
+        directory: where to keep the cache files (created if needed)
+        max_entries: maximum number of fits to keep
+        max_bytes: maximum total size of the cache files
+    """
+    def __init__(self, directory, max_entries=1000, max_bytes=100*1024**2):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def get(self, key):
+        '''return the cached entry for key, or None on a miss'''
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+            os.utime(path) #mark as recently used
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return entry
+
+    def put(self, key, entry):
+        '''store entry under key and evict the least recently used entries if the cache is over its limits'''
+        dump_atomic(entry, self._path(key))
+        self.evict()
+
+    def evict(self):
+        '''remove least recently used entries until the cache is within max_entries and max_bytes'''
+        entries = []
+        for fname in os.listdir(self.directory):
+            if not fname.endswith(".pkl"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, fname))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fname))
+        entries.sort()
+
+        total = 0
+        for entry in entries:
+            total += entry[1]
+        count = len(entries)
+        for (mtime, size, fname) in entries:
+            if (count <= self.max_entries) and (total <= self.max_bytes):
+                break
+            try:
+                os.remove(os.path.join(self.directory, fname))
+            except OSError:
+                pass #another process got there first
+            count -= 1
+            total -= size
+
+    def clear(self):
+        '''remove every entry from the cache'''
+        for fname in os.listdir(self.directory):
+            if fname.endswith(".pkl"):
+                try:
+                    os.remove(os.path.join(self.directory, fname))
+                except OSError:
+                    pass
@@ -0,0 +1,232 @@
+''' globalfit.py : joint fits of several models and observables with parameters shared between them '''
+from numpy import *
+from scipy import optimize
+import time
+from .checkpoint import differential_evolution as checkpointed_differential_evolution
+
+
+class GlobalFit:
+    """A single optimization over several (model, observable, data) sets
+
+    Observables are added with add_observable(). Their kind can be
+        'eps'     : the data is eps(w) and is compared to model(w)
+        'longeps' : the data is 1/eps(w) and is compared to model.longeps(w)
+        'raman'   : the data is a Raman intensity and is compared to the imaginary part of model(w)
+
+    Parameters are shared in two ways. A lineshape object added to more than one model is one set of
+    parameters, eg. the same libration DHO in a transverse and a Raman model. Single parameters are tied
+    with tie(), eg. the frequency of a longitudinal mode to that of a transverse one.
+
+    In each cost evaluation every distinct lineshape is evaluated once per distinct frequency grid, however
+    many models and observables use it.
+
+    Example:
+        gf = GlobalFit()
+        gf.add_observable(modelT, omegas, rp, cp)
+        gf.add_observable(modelT, omegas, Lrp, Lcp, kind='longeps')
+        gf.add_observable(modelR, Raman_omegas, Raman, kind='raman')
+        gf.tie(modelR.lineshapes[0], 'w', modelT.lineshapes[3], 'w')
+        gf.fit()
+    """
+    def __init__(self):
+        self.observables = []
+        self.grids = []
+        self.ties = {}
+        self._source = None
+        self.RMS_errors = []
+        self.fit_report = {}
+
+    def add_observable(self, model, dataX, datarp, datacp=None, kind='eps', weight=1.0, fsum=None):
+        """add a data set to the fit
+
+        args:
+            model: the SpectralModel that describes the data
+            dataX, datarp, datacp: the data; for kind='raman' datarp is the intensity and datacp is not used
+            kind: 'eps', 'longeps' or 'raman' (see the class documentation)
+            weight: multiplies this observable's contribution to the cost
+            fsum: add the f-sum rule penalty (datarp[0] - model.fsum())**2 as in fit_model (default: True for kind='eps')
+        """
+        if kind not in ('eps', 'longeps', 'raman'):
+            raise ValueError("unknown observable kind '%s', use 'eps', 'longeps' or 'raman'" % kind)
+        if (kind != 'raman') and (datacp is None):
+            raise ValueError("an observable of kind '%s' needs the imaginary part of the data (datacp)" % kind)
+        if (fsum is None):
+            fsum = (kind == 'eps')
+
+        dataX = asarray(dataX, dtype=float)
+        grid = None
+        for g in range(len(self.grids)):
+            if array_equal(self.grids[g], dataX):
+                grid = g
+        if (grid is None):
+            self.grids.append(dataX)
+            grid = len(self.grids) - 1
+
+        self.observables.append({'model': model, 'grid': grid, 'datarp': asarray(datarp, dtype=float),
+                                 'datacp': None if (datacp is None) else asarray(datacp, dtype=float),
+                                 'kind': kind, 'weight': weight, 'fsum': fsum})
+        self._source = None
+
+    def tie(self, lineshape, pname, to_lineshape, to_pname=None):
+        """make parameter pname of lineshape always equal to parameter to_pname of to_lineshape
+
+        Parameters can be given by name (from the lineshape's pnames) or index. to_pname defaults to pname.
+        """
+        if (to_pname is None):
+            to_pname = pname
+        self.ties[(id(lineshape), self._index(lineshape, pname))] = (to_lineshape, self._index(to_lineshape, to_pname))
+        self._source = None
+
+    def _index(self, lineshape, pname):
+        if isinstance(pname, str):
+            return lineshape.pnames.index(pname)
+        return pname
+
+    def lineshapes(self):
+        '''list of the distinct lineshape objects in all the models, in order of first appearance'''
+        found = []
+        seen = set()
+        for obs in self.observables:
+            for lineshape in obs['model'].lineshapes:
+                if id(lineshape) not in seen:
+                    seen.add(id(lineshape))
+                    found.append(lineshape)
+        return found
+
+    def _slots(self):
+        '''the free parameters as (lineshape, index) pairs, and for every parameter the free slot it takes its value from'''
+        free = []
+        position = {}
+        for lineshape in self.lineshapes():
+            for j in range(len(lineshape.p)):
+                if (id(lineshape), j) not in self.ties:
+                    position[(id(lineshape), j)] = len(free)
+                    free.append((lineshape, j))
+
+        source = []
+        for lineshape in self.lineshapes():
+            for j in range(len(lineshape.p)):
+                key = (id(lineshape), j)
+                visited = set()
+                while key in self.ties:
+                    if key in visited:
+                        raise ValueError("circular parameter ties in global fit")
+                    visited.add(key)
+                    (target, k) = self.ties[key]
+                    key = (id(target), k)
+                if key not in position:
+                    raise ValueError("a parameter is tied to a lineshape that is not in any of the models")
+                source.append((lineshape, j, position[key]))
+        return (free, source)
+
+    def _prepare(self):
+        (self._free, self._source) = self._slots()
+
+    def setparams(self, params):
+        """set all lineshape parameters from a vector of the free parameters"""
+        if (self._source is None):
+            self._prepare()
+        for (lineshape, j, i) in self._source:
+            lineshape.p[j] = params[i]
+
+    def getparams(self):
+        """get the free parameters as a list"""
+        self._prepare()
+        return [lineshape.p[j] for (lineshape, j) in self._free]
+
+    def getbounds(self):
+        """get the bounds of the free parameters as a list"""
+        self._prepare()
+        return [lineshape.bounds[j] for (lineshape, j) in self._free]
+
+    def _evaluate(self):
+        '''model (rp, cp) for every observable, evaluating each lineshape once per grid'''
+        cache = {}
+        responses = []
+        for obs in self.observables:
+            w = self.grids[obs['grid']]
+            rp = zeros(len(w))
+            cp = zeros(len(w))
+            for lineshape in obs['model'].lineshapes:
+                key = (id(lineshape), obs['grid'])
+                if key not in cache:
+                    cache[key] = lineshape(w)
+                (rpPart, cpPart) = cache[key]
+                rp = rp + rpPart
+                cp = cp + cpPart
+            responses.append((rp, cp))
+        return responses
+
+    def _diffsq(self):
+        '''squared residuals of each observable at the current parameters'''
+        errors = []
+        for (obs, (rp, cp)) in zip(self.observables, self._evaluate()):
+            if (obs['kind'] == 'longeps'):
+                denom = rp**2 + cp**2
+                (rp, cp) = (rp/denom, cp/denom)
+            if (obs['kind'] == 'raman'):
+                diff = (obs['datarp'] - cp)/max(abs(obs['datarp']))
+                errors.append(dot(diff, diff))
+            else:
+                diffrp = (obs['datarp'] - rp)/obs['datarp']
+                diffcp = (obs['datacp'] - cp)/obs['datacp']
+                errors.append(dot(diffrp, diffrp) + dot(diffcp, diffcp))
+        return errors
+
+    def costfun(self, params):
+        """the combined, weighted cost of all observables for a vector of free parameters"""
+        self.setparams(params)
+        cost = 0
+        for (obs, err) in zip(self.observables, self._diffsq()):
+            cost = cost + obs['weight']*err
+            if (obs['fsum'] == True):
+                cost = cost + obs['weight']*(obs['datarp'][0] - obs['model'].fsum())**2
+        return cost
+
+    def fit(self, differential_evolution=True, TNC=True, SLSQP=True, verbose=True, seed=None):
+        """fit all the observables at once, using the same optimization stages as SpectralModel.fit_model
+
+        Afterwards the lineshapes hold the fitted parameters, self.RMS_errors holds the RMS error of each
+        observable (in the order they were added), and self.fit_report the iterations of each stage.
+        """
+        start_t = time.time()
+
+        params = self.getparams()
+        bounds = self.getbounds()
+        report = {'nit': {}, 'nparams': len(params)}
+
+        if (differential_evolution == True):
+            resultobject = checkpointed_differential_evolution(self.costfun, bounds, maxiter=2000, seed=seed)
+            params = list(resultobject.x)
+            report['nit']['differential_evolution'] = resultobject.nit
+            if (verbose == True): print("diff. evolv. number of iterations = ", resultobject.nit)
+
+        if (TNC == True):
+            resultobject = optimize.minimize(self.costfun, x0=params, bounds=bounds, method='TNC')
+            params = list(resultobject.x)
+            report['nit']['TNC'] = resultobject.nit
+            if (verbose == True): print("TNC number of iterations = ", resultobject.nit)
+
+        if (SLSQP == True):
+            resultobject = optimize.minimize(self.costfun, x0=params, bounds=bounds, method='SLSQP')
+            params = list(resultobject.x)
+            report['nit']['SLSQP'] = resultobject.nit
+            if (verbose == True): print("SLSQP number of iterations = ", resultobject.nit)
+
+        report['cost'] = float(self.costfun(params))
+        end_t = time.time()
+        report['time'] = end_t - start_t
+        self.fit_report = report
+
+        self.RMS_errors = []
+        for (obs, err) in zip(self.observables, self._diffsq()):
+            npts = len(self.grids[obs['grid']])
+            if (obs['kind'] != 'raman'):
+                npts = 2*npts
+            self.RMS_errors.append(sqrt(err/npts))
+        for i in range(len(self.observables)): #the last one wins for a model used in several observables
+            self.observables[i]['model'].RMS_error = self.RMS_errors[i]
+
+        m, s = divmod(end_t - start_t, 60)
+        h, m = divmod(m, 60)
+        if (verbose == True): print("Global fit of %d parameters completed in %02d hr %02d min %02d sec" % (len(params), h, m, s))
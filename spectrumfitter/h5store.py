@@ -0,0 +1,270 @@
+''' h5store.py : HDF5 store for large collections of spectra and the fit results of models on them
+
+Layout of the file:
+
+    /grids/<grid id>              the frequency grid (1D), shared by every spectrum measured on it
+    /spectra/<grid id>            (K x 2 x N) real and complex parts of the K spectra on that grid,
+                                  chunked one spectrum per chunk and compressed
+    /index/name, /index/grid, /index/row
+                                  the name of every spectrum and where its data is
+    /results/<setup signature>/   one table per model structure, bounds and fit options (see
+                                  fitcache.setup_signature), so fits with different bounds or options are
+                                  kept apart:
+        name                      the spectrum each row was fit to
+        params                    (K x P) fitted parameters
+        RMS_error                 (K) RMS errors
+        attrs 'spec', 'paramnames'  JSON of the model (see modelspec.model_to_spec) and of its parameter names
+        attrs 'options'           the fit options, as text
+
+Data is only read when it is asked for, and spectra are read one chunk at a time, so collections much
+larger than memory can be streamed through fit_model. This module needs h5py.
+'''
+from numpy import *
+from copy import deepcopy
+import hashlib
+import json
+import h5py
+from .fitcache import setup_signature
+from .modelspec import model_to_spec
+from .spectrumfitter import load_spectrum
+
+
+def grid_id(omegas):
+    '''identifier of a frequency grid: hash of its values'''
+    return hashlib.sha256(ascontiguousarray(omegas, dtype=float64).tobytes()).hexdigest()[0:16]
+
+
+class SpectrumStore:
+    """A collection of spectra and fit results in one HDF5 file
+
+    Example:
+        with SpectrumStore("water.h5") as store:
+            store.import_files(glob.glob("data/*.RI"))
+            store.fit_all(model, differential_evolution=False)
+            (names, params, RMS_errors) = store.results(model)
+
+    args:
+        fname: the HDF5 file
+        mode: h5py file mode, 'a' (read/write, create if needed), 'r' (read only) or 'w' (create, truncate)
+        compression: compression filter of the spectra datasets (eg. 'gzip', 'lzf' or None)
+    """
+    def __init__(self, fname, mode='a', compression='gzip'):
+        self.file = h5py.File(fname, mode)
+        self.compression = compression
+        self._index = None
+        self._result_rows = {}
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    #---------------------------------------------------------------------------------------------------------
+    # spectra
+
+    def _load_index(self):
+        if (self._index is None):
+            self._index = {}
+            if ("index" in self.file):
+                names = self.file["index/name"].asstr()[...]
+                grids = self.file["index/grid"].asstr()[...]
+                rows = self.file["index/row"][...]
+                for i in range(len(names)):
+                    self._index[names[i]] = (grids[i], int(rows[i]), i)
+        return self._index
+
+    def names(self):
+        '''names of all the spectra, in the order they were added'''
+        index = self._load_index()
+        return sorted(index, key=lambda name: index[name][2])
+
+    def __len__(self):
+        return len(self._load_index())
+
+    def __contains__(self, name):
+        return name in self._load_index()
+
+    def grids(self):
+        '''ids of all the frequency grids'''
+        return list(self.file["grids"].keys()) if ("grids" in self.file) else []
+
+    def grid(self, gid):
+        '''the frequency grid with the given id'''
+        return self.file["grids/" + gid][...]
+
+    def spectra_on_grid(self, gid):
+        """the (K x 2 x N) h5py dataset of the spectra on a grid, for lazy slicing
+
+        eg. store.spectra_on_grid(gid)[100:200, 1, :] reads only the complex parts of spectra 100 to 199.
+        """
+        return self.file["spectra/" + gid]
+
+    def _append(self, path, values, dtype):
+        '''append values to the resizable 1D dataset at path, creating it if needed'''
+        if path not in self.file:
+            self.file.create_dataset(path, shape=(0,), maxshape=(None,), dtype=dtype, chunks=(1024,))
+        ds = self.file[path]
+        ds.resize((len(ds) + len(values),))
+        ds[len(ds) - len(values):] = values
+
+    def add_spectrum(self, name, omegas, rp, cp, overwrite=False):
+        """add a spectrum to the store
+
+        Spectra with the same frequencies share one grid and are stored as rows of one chunked dataset.
+        An existing spectrum with the same name raises a ValueError unless overwrite=True.
+        """
+        omegas = asarray(omegas, dtype=float)
+        if (len(rp) != len(omegas)) or (len(cp) != len(omegas)):
+            raise ValueError("spectrum '%s' has %d frequencies but %d and %d values" % (name, len(omegas), len(rp), len(cp)))
+        index = self._load_index()
+        if (name in index) and not overwrite:
+            raise ValueError("spectrum '%s' is already in the store" % name)
+
+        gid = grid_id(omegas)
+        if ("grids/" + gid) not in self.file:
+            self.file.create_dataset("grids/" + gid, data=omegas)
+            self.file.create_dataset("spectra/" + gid, shape=(0, 2, len(omegas)), maxshape=(None, 2, len(omegas)), dtype=float64,
+                                     chunks=(1, 2, len(omegas)), compression=self.compression, shuffle=(self.compression is not None))
+        data = self.file["spectra/" + gid]
+
+        if (name in index) and (index[name][0] == gid):
+            data[index[name][1]] = [rp, cp] #same grid, write in place
+            return
+        row = len(data)
+        data.resize((row + 1, 2, len(omegas)))
+        data[row] = [rp, cp]
+        if (name in index): #moved to another grid, the old row is left unused
+            position = index[name][2]
+            self.file["index/grid"][position] = gid
+            self.file["index/row"][position] = row
+        else:
+            position = len(index)
+            self._append("index/name", [name], h5py.string_dtype())
+            self._append("index/grid", [gid], h5py.string_dtype())
+            self._append("index/row", [row], int64)
+        index[name] = (gid, row, position)
+
+    def import_files(self, fnames, names=None, overwrite=False, **load_options):
+        """add spectra from text files (read with load_spectrum), by default named after the files
+
+        load_options are passed to load_spectrum (fmt, min_freq, max_freq).
+        """
+        for i in range(len(fnames)):
+            (omegas, rp, cp) = load_spectrum(fnames[i], **load_options)
+            self.add_spectrum(fnames[i] if (names is None) else names[i], omegas, rp, cp, overwrite=overwrite)
+
+    def __getitem__(self, name):
+        '''(omegas, rp, cp) of a spectrum, reading only its own rows from the file'''
+        index = self._load_index()
+        if name not in index:
+            raise KeyError(name)
+        (gid, row, position) = index[name]
+        (rp, cp) = self.file["spectra/" + gid][row]
+        return (self.grid(gid), rp, cp)
+
+    def iter_spectra(self, names=None):
+        """generator of (name, omegas, rp, cp) for the named spectra (default all), read one at a time"""
+        grids = {}
+        index = self._load_index()
+        for name in (self.names() if (names is None) else names):
+            (gid, row, position) = index[name]
+            if gid not in grids:
+                grids[gid] = self.grid(gid)
+            (rp, cp) = self.file["spectra/" + gid][row]
+            yield (name, grids[gid], rp, cp)
+
+    #---------------------------------------------------------------------------------------------------------
+    # fit results
+
+    def _result_group(self, model, options):
+        path = "results/" + setup_signature(model, options)
+        if path not in self.file:
+            group = self.file.create_group(path)
+            group.attrs["spec"] = json.dumps(model_to_spec(model))
+            group.attrs["paramnames"] = json.dumps(model.getparamnames())
+            group.attrs["options"] = repr(sorted(options.items()))
+            nparams = len(model.getparams())
+            group.create_dataset("name", shape=(0,), maxshape=(None,), dtype=h5py.string_dtype(), chunks=(1024,))
+            group.create_dataset("params", shape=(0, nparams), maxshape=(None, nparams), dtype=float64, chunks=(256, int(maximum(nparams, 1))))
+            group.create_dataset("RMS_error", shape=(0,), maxshape=(None,), dtype=float64, chunks=(1024,))
+        return self.file[path]
+
+    def _rows(self, group):
+        '''row of every spectrum name in a results table'''
+        if group.name not in self._result_rows:
+            names = group["name"].asstr()[...]
+            self._result_rows[group.name] = dict(zip(names, range(len(names))))
+        return self._result_rows[group.name]
+
+    def save_result(self, name, model, options={}):
+        """store the current parameters and RMS_error of model as its fit to spectrum name with the fit_model options
+
+        Results are kept per model structure, bounds and options (setup_signature), one row per spectrum; a
+        later fit with the same setup to the same spectrum replaces the earlier one.
+        """
+        group = self._result_group(model, options)
+        rows = self._rows(group)
+        if name in rows:
+            row = rows[name]
+        else:
+            row = len(group["name"])
+            for key in ("name", "RMS_error"):
+                group[key].resize((row + 1,))
+            group["params"].resize((row + 1, group["params"].shape[1]))
+            group["name"][row] = name
+            rows[name] = row
+        group["params"][row] = model.getparams()
+        group["RMS_error"][row] = model.RMS_error
+
+    def result(self, name, model, options={}):
+        """set the parameters and RMS_error of model from its stored fit to spectrum name with the fit_model
+        options; returns the parameters
+
+        Raises a KeyError if there is no such fit.
+        """
+        path = "results/" + setup_signature(model, options)
+        if path not in self.file:
+            raise KeyError("no results for this model structure, bounds and options")
+        group = self.file[path]
+        rows = self._rows(group)
+        if name not in rows:
+            raise KeyError(name)
+        params = list(group["params"][rows[name]])
+        model.setparams(params)
+        model.RMS_error = float(group["RMS_error"][rows[name]])
+        return params
+
+    def results(self, model, options={}):
+        """the whole results table of a model structure, bounds and fit options: (names, (K x P) parameters, RMS errors)
+
+        model can also be a setup signature string (see signatures()).
+        """
+        sig = model if isinstance(model, str) else setup_signature(model, options)
+        if ("results/" + sig) not in self.file:
+            return ([], zeros((0, 0)), zeros(0))
+        group = self.file["results/" + sig]
+        return (list(group["name"].asstr()[...]), group["params"][...], group["RMS_error"][...])
+
+    def signatures(self):
+        '''setup signatures that have results in the store'''
+        return list(self.file["results"].keys()) if ("results" in self.file) else []
+
+    def fit_all(self, model, names=None, skip_done=True, verbose=True, **fit_options):
+        """fit a copy of model to each of the named spectra (default all), streaming them from the file
+        one at a time, and save every result as it finishes
+
+        Every fit starts from the parameters of model, which is not modified. With skip_done, spectra that
+        already have a result for this model structure, bounds and fit_options are skipped, so an interrupted
+        batch can be rerun. fit_options are passed to fit_model.
+        """
+        done = self._rows(self._result_group(model, fit_options)) if skip_done else {}
+        for (name, omegas, rp, cp) in self.iter_spectra([n for n in (self.names() if (names is None) else names) if n not in done]):
+            fitted = deepcopy(model)
+            fitted.fit_model(omegas, rp, cp, verbose=False, **fit_options)
+            self.save_result(name, fitted, fit_options)
+            self.file.flush()
+            if (verbose == True): print("%s  RMS error = %6.3f" % (name, fitted.RMS_error))
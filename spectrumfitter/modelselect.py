@@ -0,0 +1,208 @@
+''' modelselect.py : choose the lineshapes of a model by fitting combinations of candidates in parallel and ranking them by AIC/BIC '''
+from numpy import *
+from copy import deepcopy
+from itertools import combinations
+from multiprocessing import Pool
+import time
+from .spectralmodel import SpectralModel
+
+
+def information_criteria(RMS_error, npoints, nparams):
+    '''(AIC, BIC) of a least squares fit with the given RMS error, number of data points and of parameters'''
+    rss = npoints*RMS_error**2
+    loglike = npoints*log(maximum(rss/npoints, 1e-300))
+    return (loglike + 2*nparams, loglike + nparams*log(npoints))
+
+
+class SelectionResult:
+    """Holds the candidate models tried by select_model(), best first
+
+    attributes:
+        candidates: list of dicts, one per combination tried, with keys
+                    'names'     : the lineshape names of the combination
+                    'model'     : the SpectralModel, left at its fitted parameters
+                    'nparams'   : number of parameters
+                    'RMS_error' : RMS error of the fit
+                    'aic', 'bic': the information criteria
+                    'stage'     : how far the candidate got, 'global' (fit with DE), 'local' (local fit
+                                  finished) or 'pruned' (outside the margin, left at its screening fit or
+                                  its finished local fit)
+                    Candidates are sorted by stage, then by the chosen criterion.
+        criterion: 'aic' or 'bic', the criterion used for pruning and ranking
+        best: the model of the first candidate
+    """
+    def __init__(self, candidates, criterion):
+        order = {'global': 0, 'local': 1, 'pruned': 2}
+        self.criterion = criterion
+        self.candidates = sorted(candidates, key=lambda c: (order[c['stage']], c[criterion]))
+        self.best = self.candidates[0]['model'] if (len(self.candidates) > 0) else None
+
+    def print_ranking(self, n=None):
+        """Write out the candidates with their RMS error and information criteria, best first"""
+        print("%4s %8s %9s %10s %10s %7s   %s" % ("rank", "stage", "nparams", "AIC", "BIC", "RMS", "lineshapes"))
+        for i in range(len(self.candidates[:n])):
+            c = self.candidates[i]
+            print("%4d %8s %9d %10.2f %10.2f %7.4f   %s" % (i + 1, c['stage'], c['nparams'], c['aic'], c['bic'], c['RMS_error'], " + ".join(c['names'])))
+
+
+def _fit_candidate(args):
+    '''fit one candidate model, returning its fitted parameters, RMS error and fit report'''
+    (model, dataX, datarp, datacp, fit_options) = args
+    model.fit_model(dataX, datarp, datacp, verbose=False, **fit_options)
+    return (model.getparams(), model.RMS_error, model.fit_report)
+
+
+def select_model(components, dataX, datarp, datacp, base=[], min_components=1, max_components=None, strategy='exhaustive',
+                 criterion='bic', top=3, margin=10.0, screen_maxiter=30, processes=None, seed=None, verbose=True, **fit_options):
+    """find the combination of candidate lineshapes that best describes a spectrum
+
+    Combinations are fit in order of size. Each one is first screened with a cheap local fit capped at
+    screen_maxiter (see local_maxiter in fit_model), warm started from the screened fit of its best subset
+    with one component less. Truncated fits from the components' own starting parameters rank combinations
+    too erratically to prune on, but warm started ones begin close to an optimum, where a short local run
+    already gives a usable value of the criterion. Combinations whose screened criterion is worse than the
+    best one so far by more than margin are pruned at that point: their local fit is never finished, and
+    with the greedy strategy they are not extended. The others are fit to convergence with the local stages,
+    and only the top of those go through the expensive differential evolution stage of fit_model. All the
+    fits of a step are spread across a process pool.
+
+    The default margin of 10 is the difference in BIC usually taken as very strong evidence against a
+    model. A screened fit only gives an upper bound on the criterion the combination can reach, so a larger
+    screen_maxiter or margin makes wrong pruning less likely at the cost of finishing more fits.
+
+    Combinations are built either
+        'exhaustive' : all subsets of the components with min_components to max_components members
+        'greedy'     : starting from the best subset of min_components members, add the component that
+                       improves the criterion most, until none does or max_components is reached
+
+    args:
+        components: the candidate lineshape objects, each used at most once per combination (pass two
+                    Debye objects, eg. with different starting relaxation times, to allow two Debye terms).
+                    Their current parameters are the starting points; they are not modified.
+        dataX, datarp, datacp: the data, as for fit_model
+        base: lineshapes included in every combination, eg. a constant for eps(inf)
+        min_components, max_components: range of the number of components per combination (default all)
+        strategy: 'exhaustive' or 'greedy'
+        criterion: 'aic' or 'bic'
+        top: number of combinations that are fit with differential evolution (0 = local fits only)
+        margin: pruning margin in units of the criterion
+        screen_maxiter: budget of the screening fits
+        processes: number of worker processes (None = number of CPUs, 1 = run serially)
+        seed: integer seed for differential evolution
+        verbose: print the progress of the selection
+        fit_options: passed to fit_model for every fit (eg. constraints='fsum')
+    returns:
+        a SelectionResult
+    """
+    if criterion not in ('aic', 'bic'):
+        raise ValueError("unknown criterion '%s', use 'aic' or 'bic'" % criterion)
+    if strategy not in ('exhaustive', 'greedy'):
+        raise ValueError("unknown strategy '%s', use 'exhaustive' or 'greedy'" % strategy)
+    if (max_components is None):
+        max_components = len(components)
+
+    start_t = time.time()
+    dataX = asarray(dataX, dtype=float)
+    datarp = asarray(datarp, dtype=float)
+    datacp = asarray(datacp, dtype=float)
+    npoints = 2*len(dataX)
+
+    pool = None if (processes == 1) else Pool(processes)
+    screened = {} #screened candidates by their tuple of component indices, for warm starts
+    best = [inf] #best screened criterion so far
+
+    def fit_all(candidates, options):
+        '''fit the models of all candidates with fit_model(**options) and update their criteria'''
+        tasks = [(c['model'], dataX, datarp, datacp, dict(fit_options, **options)) for c in candidates]
+        results = map(_fit_candidate, tasks) if (pool is None) else pool.map(_fit_candidate, tasks)
+        for (c, (params, RMS_error, report)) in zip(candidates, results):
+            c['model'].setparams(params)
+            c['model'].RMS_error = RMS_error
+            c['model'].fit_report = report
+            c['RMS_error'] = RMS_error
+            (c['aic'], c['bic']) = information_criteria(RMS_error, npoints, c['nparams'])
+
+    def candidate(chosen):
+        '''a new candidate for a combination, warm started from the best screened subset one component smaller
+
+        The warm start is what makes the truncated screening fits reliable enough to prune on.
+        '''
+        lineshapes = deepcopy(list(base) + [components[i] for i in chosen])
+        subsets = [screened[sub] for sub in combinations(chosen, len(chosen) - 1) if sub in screened]
+        if (len(subsets) > 0):
+            sub = sorted(subsets, key=lambda c: c[criterion])[0]
+            fitted = sub['model'].lineshapes
+            for j in range(len(base)):
+                lineshapes[j].p = list(fitted[j].p)
+            for (k, i) in enumerate(sub['chosen']):
+                lineshapes[len(base) + chosen.index(i)].p = list(fitted[len(base) + k].p)
+        model = SpectralModel([])
+        for lineshape in lineshapes:
+            model.add(lineshape)
+        return {'chosen': chosen, 'names': [l.name for l in model.lineshapes], 'model': model,
+                'nparams': len(model.getparams()), 'stage': 'local'}
+
+    def screen(combos):
+        '''screen a list of combinations (tuples of component indices), prune them and finish the survivors'''
+        candidates = [candidate(chosen) for chosen in combos]
+        fit_all(candidates, {'differential_evolution': False, 'local_maxiter': screen_maxiter})
+        for c in candidates:
+            screened[c['chosen']] = c
+            best[0] = minimum(best[0], c[criterion])
+        survivors = []
+        for c in candidates:
+            if (c[criterion] > best[0] + margin):
+                c['stage'] = 'pruned'
+            else:
+                survivors.append(c)
+        fit_all(survivors, {'differential_evolution': False})
+        if (verbose == True): print("screened %d combinations, finished the local fits of %d" % (len(candidates), len(survivors)))
+        return candidates
+
+    def best_of(candidates):
+        return sorted(candidates, key=lambda c: c[criterion])[0]
+
+    try:
+        if (strategy == 'exhaustive'):
+            tried = []
+            for k in range(min_components, max_components + 1):
+                tried += screen(list(combinations(range(len(components)), k)))
+        else:
+            tried = screen(list(combinations(range(len(components)), min_components)))
+            current = best_of([c for c in tried if c['stage'] == 'local'])
+            while (len(current['chosen']) < max_components):
+                step = screen([tuple(sorted(current['chosen'] + (i,))) for i in range(len(components)) if i not in current['chosen']])
+                tried += step
+                finished = [c for c in step if c['stage'] == 'local']
+                if (len(finished) == 0) or (best_of(finished)[criterion] >= current[criterion]):
+                    break
+                current = best_of(finished)
+
+        finished = [c for c in tried if c['stage'] == 'local']
+        best[0] = best_of(finished)[criterion]
+        for c in finished: #a finished fit can still fall outside the margin of a better one finished later
+            if (c[criterion] > best[0] + margin):
+                c['stage'] = 'pruned'
+        finished = [c for c in finished if c['stage'] == 'local']
+        if (verbose == True): print("%d of %d combinations pruned" % (len(tried) - len(finished), len(tried)))
+
+        finalists = sorted(finished, key=lambda c: c[criterion])[:top]
+        if (len(finalists) > 0):
+            if (verbose == True): print("fitting the top %d combinations with differential evolution" % len(finalists))
+            fit_all(finalists, {'differential_evolution': True, 'seed': seed})
+            for c in finalists:
+                c['stage'] = 'global'
+    finally:
+        if (pool is not None):
+            pool.close()
+            pool.join()
+
+    for c in tried:
+        del c['chosen']
+    result = SelectionResult(tried, criterion)
+
+    end_t = time.time()
+    m, s = divmod(end_t - start_t, 60)
+    h, m = divmod(m, 60)
+    if (verbose == True): print("Model selection over %d combinations completed in %02d hr %02d min %02d sec" % (len(tried), h, m, s))
+    return result
@@ -0,0 +1,70 @@
+''' modelspec.py : build SpectralModel objects from declarative (JSON) model specifications
+
+A model specification is a dictionary such as
+
+    {"lineshapes": [
+        {"type": "Debye",      "params": [69, 0.55],         "bounds": [[65, 73], [0.3, 0.65]],                  "name": "Debye"},
+        {"type": "BrendelDHO", "params": [0.3, 460, 100, 40], "bounds": [[0.01, 100], [400, 520], [1, 500], [1, 150]], "name": "Brendel L1"},
+        {"type": "constant",   "params": [2],                 "bounds": [[1, 11]],                                "name": "eps inf"}],
+     "data": {"min_freq": 0.1, "max_freq": 1000},
+     "fit":  {"differential_evolution": true, "TNC": true, "SLSQP": true, "seed": 0}}
+
+where "type" is the name of a lineshape class in spectrumfitter.spectrumfitter. The "data" and "fit"
+sections are optional and hold keyword arguments for load_spectrum and fit_model respectively.
+'''
+import inspect
+import json
+from . import spectrumfitter as lineshapes
+from .spectralmodel import SpectralModel
+
+
+def lineshape_class(typename):
+    '''return the lineshape class with the given name'''
+    cls = getattr(lineshapes, typename, None)
+    if not (isinstance(cls, type) and issubclass(cls, lineshapes.Lineshape)):
+        raise ValueError("unknown lineshape type '%s'" % typename)
+    return cls
+
+
+def model_from_spec(spec):
+    '''build a SpectralModel from a model specification dictionary (only the "lineshapes" entry is used)'''
+    model = SpectralModel()
+    for entry in spec["lineshapes"]:
+        cls = lineshape_class(entry["type"])
+        params = [float(x) for x in entry["params"]]
+        bounds = [(float(lo), float(hi)) for (lo, hi) in entry["bounds"]]
+        if (len(params) != len(bounds)):
+            raise ValueError("lineshape '%s' has %d params but %d bounds" % (entry.get("name", entry["type"]), len(params), len(bounds)))
+        model.add(cls(params, bounds, entry.get("name", entry["type"])))
+    return model
+
+
+def check_model_spec(spec):
+    '''raise a ValueError if a model specification cannot be used: the lineshapes must build a model, and
+    the "data" and "fit" sections may only hold keyword arguments of load_spectrum and fit_model'''
+    try:
+        model_from_spec(spec)
+    except (KeyError, TypeError) as e:
+        raise ValueError("malformed lineshape entry (%s: %s)" % (type(e).__name__, e))
+    for (section, function) in (("data", lineshapes.load_spectrum), ("fit", SpectralModel.fit_model)):
+        allowed = set(inspect.signature(function).parameters)
+        unknown = sorted(set(spec.get(section, {})) - allowed)
+        if (len(unknown) > 0):
+            raise ValueError("unknown option(s) %s in the \"%s\" section" % (", ".join(unknown), section))
+
+
+def model_to_spec(model):
+    '''the "lineshapes" specification of a SpectralModel, with its current parameters'''
+    spec = {"lineshapes": []}
+    for lineshape in model.lineshapes:
+        spec["lineshapes"].append({"type": type(lineshape).__name__,
+                                   "params": [float(x) for x in lineshape.p],
+                                   "bounds": [[float(lo), float(hi)] for (lo, hi) in lineshape.bounds],
+                                   "name": lineshape.name})
+    return spec
+
+
+def load_model_spec(fname):
+    '''read a model specification from a JSON file'''
+    with open(fname) as f:
+        return json.load(f)
@@ -0,0 +1,164 @@
+''' scheduler.py : asyncio scheduler that runs fits on an executor with priorities, progress reports and cancellation '''
+import asyncio
+import itertools
+import queue
+import threading
+from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+
+
+class FitCancelled(Exception):
+    """Raised inside a fit when its job has been cancelled"""
+    pass
+
+
+def _run_fit(model, dataX, datarp, datacp, fit_options, cancel_event, progress_queue):
+    '''executor side of a job: fit the model, checking for cancellation and reporting progress from the optimizer callback'''
+    def callback(stage, params, cost):
+        if cancel_event.is_set():
+            raise FitCancelled()
+        progress_queue.put((stage, cost))
+
+    model.fit_model(dataX, datarp, datacp, verbose=False, callback=callback, **fit_options)
+    return model
+
+
+def _retrieve(fut):
+    '''done callback that marks the exception of an executor future as retrieved'''
+    if not fut.cancelled():
+        fut.exception()
+
+
+class FitScheduler:
+    """Runs fit_model calls on an executor from asyncio code without blocking the event loop
+
+    Jobs wait in a priority queue and at most max_workers run at once, so a job submitted with a lower
+    priority number starts before any waiting job with a higher one. By default local-only refits
+    (differential_evolution=False) get priority 0 and fits with a global DE stage priority 10, so short
+    refits jump ahead of long global fits.
+
+    Cancelling the task awaiting submit_fit() removes a waiting job from the queue, or stops a running fit at
+    the next optimizer iteration (including mid-DE).
+
+    args:
+        executor: a concurrent.futures executor. The default is a ProcessPoolExecutor; a ThreadPoolExecutor
+                  can stand in for it to run everything in-process, eg. in tests.
+        max_workers: number of fits to run at once
+        poll_interval: seconds between checks for progress reports from running fits
+    """
+    def __init__(self, executor=None, max_workers=2, poll_interval=0.1):
+        if (executor is None):
+            executor = ProcessPoolExecutor(max_workers)
+        self.executor = executor
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self._manager = Manager() if isinstance(executor, ProcessPoolExecutor) else None
+        self._counter = itertools.count()
+        self._queue = None
+        self._dispatchers = []
+        self._running = []
+
+    def _event(self):
+        return self._manager.Event() if (self._manager is not None) else threading.Event()
+
+    def _progress_queue(self):
+        return self._manager.Queue() if (self._manager is not None) else queue.Queue()
+
+    def _start(self):
+        if (self._queue is None):
+            self._queue = asyncio.PriorityQueue()
+            self._dispatchers = [asyncio.ensure_future(self._dispatch()) for i in range(self.max_workers)]
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            (priority, seq, job) = await self._queue.get()
+            if job['future'].done(): #cancelled while waiting
+                continue
+            fut = loop.run_in_executor(self.executor, _run_fit, job['model'], job['dataX'], job['datarp'], job['datacp'],
+                                       job['fit_options'], job['cancel'], job['progress_queue'])
+            fut.add_done_callback(_retrieve) #also when this dispatcher is cancelled before the fit ends
+            self._running.append(job)
+            try:
+                while not fut.done():
+                    await asyncio.wait([fut], timeout=self.poll_interval)
+                    self._report_progress(job)
+            finally:
+                self._running.remove(job)
+            exception = fut.exception() #always retrieved, a cancelled job ends with FitCancelled
+            if job['future'].done():
+                continue
+            if (exception is not None):
+                job['future'].set_exception(exception)
+            else:
+                job['future'].set_result(fut.result())
+
+    def _report_progress(self, job):
+        while True:
+            try:
+                (stage, cost) = job['progress_queue'].get_nowait()
+            except queue.Empty:
+                return
+            if (job['progress'] is not None) and not job['future'].done():
+                job['progress'](stage, cost)
+
+    async def submit_fit(self, model, dataX, datarp, datacp, priority=None, progress=None, **fit_options):
+        """fit model to the data on the executor and update model with the result
+
+        args:
+            model: a SpectralModel; it is fit as a copy and only updated once the fit has finished
+            dataX, datarp, datacp: the data, as for fit_model
+            priority: lower numbers run first (default 0 for local-only fits, 10 for fits with a DE stage)
+            progress: optional function called on the event loop as progress(stage, cost) during the fit
+            fit_options: keyword arguments for fit_model
+        returns:
+            model, after its parameters, RMS_error and fit_report have been updated
+        """
+        self._start()
+        if (priority is None):
+            priority = 10 if fit_options.get('differential_evolution', True) else 0
+
+        job = {'model': deepcopy(model), 'dataX': dataX, 'datarp': datarp, 'datacp': datacp, 'fit_options': fit_options,
+               'cancel': self._event(), 'progress_queue': self._progress_queue(), 'progress': progress,
+               'future': asyncio.get_running_loop().create_future()}
+        await self._queue.put((priority, next(self._counter), job))
+
+        try:
+            fitted = await job['future']
+        except asyncio.CancelledError:
+            job['cancel'].set()
+            raise
+
+        model.setparams(fitted.getparams())
+        model.RMS_error = fitted.RMS_error
+        model.fit_report = fitted.fit_report
+        return model
+
+    async def close(self):
+        '''cancel running and waiting fits, stop the dispatchers and shut down the executor
+
+        Every submit_fit() call that has not finished yet raises FitCancelled.
+        '''
+        jobs = list(self._running)
+        while (self._queue is not None) and not self._queue.empty():
+            (priority, seq, job) = self._queue.get_nowait()
+            jobs.append(job)
+        for job in jobs:
+            job['cancel'].set()
+            if not job['future'].done():
+                job['future'].set_exception(FitCancelled("the scheduler was closed"))
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        self._dispatchers = []
+        self._queue = None
+        self.executor.shutdown(wait=False)
+        if (self._manager is not None):
+            self._manager.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
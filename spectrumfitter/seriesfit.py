@@ -0,0 +1,236 @@
+''' seriesfit.py : fit a series of spectra (eg. one per temperature) as one problem with continuity between them '''
+from numpy import *
+from scipy import optimize
+from scipy.sparse import lil_matrix
+from copy import deepcopy
+import time
+
+
+class SeriesFit:
+    """Fit one SpectralModel to a series of spectra taken at different temperatures
+
+    Every model parameter has a temperature dependence, set with set_dependence():
+        'constant'     : the same value at every temperature
+        ('poly', n)    : a polynomial of order n in the temperature
+        'arrhenius'    : A*exp(-Ea/T)
+        'free'         : a separate value at every temperature, optionally with a smoothness penalty on the
+                         differences between neighbouring temperatures (this is the default)
+
+    The trends are parametrized by their values at a few temperatures (nodes) spread over the range of the
+    series: a constant by its value, a polynomial by its values at n + 1 Chebyshev-Lobatto nodes (the lowest
+    and highest temperature for n = 1), and an Arrhenius law, whose logarithm is linear in 1/T, by its values
+    at the lowest and highest temperature. The parameter bounds are bounds on these node values, which keeps
+    constant, linear and Arrhenius trends within the bounds at every temperature without clipping, so the
+    optimizer always sees a gradient. A polynomial of higher order can overshoot the bounds slightly between
+    its nodes.
+
+    All spectra are fit together with scipy's least_squares. The residuals of one spectrum only depend on
+    the shared (constant/polynomial/Arrhenius) coefficients and on that spectrum's free parameters; this
+    block-sparse Jacobian structure is passed to the optimizer so the cost of a fit grows linearly with the
+    number of spectra.
+
+    args:
+        model: the SpectralModel; its current parameters are the starting point at every temperature
+        temperatures: list of the temperatures of the spectra
+        spectra: list of (dataX, datarp, datacp) tuples, one per temperature; frequency grids may differ
+        smoothness: default weight of the smoothness penalty for free parameters
+    """
+    def __init__(self, model, temperatures, spectra, smoothness=0.0):
+        if (len(temperatures) != len(spectra)):
+            raise ValueError("need one temperature per spectrum")
+        self.model = model
+        self.temperatures = asarray(temperatures, dtype=float)
+        self.spectra = [tuple(asarray(d, dtype=float) for d in spectrum) for spectrum in spectra]
+        nparams = len(model.getparams())
+        self.modes = ['free']*nparams
+        self.smoothness = [smoothness]*nparams
+        self.table = None
+        self.RMS_errors = []
+        self.fit_report = {}
+
+    def _index(self, lineshape, pname):
+        offset = 0
+        for l in self.model.lineshapes:
+            if (l is lineshape):
+                if isinstance(pname, str):
+                    return offset + l.pnames.index(pname)
+                return offset + pname
+            offset += len(l.p)
+        raise ValueError("lineshape '%s' is not in the model" % lineshape.name)
+
+    def set_dependence(self, lineshape, pname, mode, smoothness=None):
+        """set the temperature dependence of parameter pname (a name from pnames, or an index) of lineshape
+
+        mode is 'constant', 'free', 'arrhenius' or ('poly', order). smoothness sets the penalty weight for 'free'.
+        """
+        i = self._index(lineshape, pname)
+        if not ((mode in ('constant', 'free', 'arrhenius')) or (isinstance(mode, tuple) and (mode[0] == 'poly'))):
+            raise ValueError("unknown temperature dependence %r" % (mode,))
+        self.modes[i] = mode
+        if (smoothness is not None):
+            self.smoothness[i] = smoothness
+
+    def _layout(self):
+        '''the coefficient indices, starting values and bounds for every parameter'''
+        K = len(self.spectra)
+        params = self.model.getparams()
+        bounds = self.model.getbounds()
+        columns = []
+        x0 = []
+        lb = []
+        ub = []
+        for i in range(len(params)):
+            mode = self.modes[i]
+            (lo, hi) = bounds[i]
+            start = len(x0)
+            if (mode == 'constant'):
+                x0 += [params[i]]
+                lb += [lo]
+                ub += [hi]
+            elif (mode == 'free'):
+                x0 += [params[i]]*K
+                lb += [lo]*K
+                ub += [hi]*K
+            elif (mode == 'arrhenius'):
+                if (params[i] <= 0) or (hi <= 0):
+                    raise ValueError("an Arrhenius parameter needs a positive starting value and upper bound")
+                x0 += [log(params[i])]*2 #log of the values at the lowest and highest temperature
+                lb += [log(lo) if (lo > 0) else -inf]*2
+                ub += [log(hi)]*2
+            else:
+                x0 += [params[i]]*(mode[1] + 1) #the values at the nodes
+                lb += [lo]*(mode[1] + 1)
+                ub += [hi]*(mode[1] + 1)
+            columns.append(list(range(start, len(x0))))
+
+        x0 = array(x0, dtype=float)
+        lb = array(lb, dtype=float)
+        ub = array(ub, dtype=float)
+        #least_squares needs a starting point strictly inside the bounds
+        x0 = clip(x0, lb + 1e-10*(1 + abs(where(isfinite(lb), lb, 0))), ub - 1e-10*(1 + abs(where(isfinite(ub), ub, 0))))
+        return (columns, x0, lb, ub)
+
+    def _trend(self, z, order):
+        '''(K x order+1) matrix that interpolates values at order + 1 Chebyshev-Lobatto nodes spanning z to the points z'''
+        (lo, hi) = (z.min(), z.max())
+        if (hi == lo):
+            (lo, hi) = (lo - 0.5, lo + 0.5)
+        nodes = (lo + hi)/2 - (hi - lo)/2*cos(pi*arange(order + 1)/maximum(order, 1))
+        B = ones((len(z), order + 1))
+        for j in range(order + 1):
+            for m in range(order + 1):
+                if (m != j):
+                    B[:,j] *= (z - nodes[m])/(nodes[j] - nodes[m])
+        return B
+
+    def values(self, x):
+        """the (K x P) table of parameter values at every temperature for the coefficient vector x"""
+        K = len(self.spectra)
+        table = zeros((K, len(self.modes)))
+        for i in range(len(self.modes)):
+            mode = self.modes[i]
+            c = x[self._columns[i]]
+            if (mode == 'constant'):
+                table[:,i] = c[0]
+            elif (mode == 'free'):
+                table[:,i] = c
+            elif (mode == 'arrhenius'):
+                table[:,i] = exp(dot(self._trend(1/self.temperatures, 1), c))
+            else:
+                table[:,i] = dot(self._trend(self.temperatures, mode[1]), c)
+        return table
+
+    def residuals(self, x):
+        """relative residuals of all spectra followed by the smoothness penalties, for coefficient vector x"""
+        table = self.values(x)
+        res = []
+        for k in range(len(self.spectra)):
+            (dataX, datarp, datacp) = self.spectra[k]
+            self.model.setparams(table[k])
+            (rp, cp) = self.model(dataX)
+            res.append((datarp - rp)/datarp)
+            res.append((datacp - cp)/datacp)
+        order = argsort(self.temperatures)
+        for i in self._smoothed:
+            scale = maximum(abs(table[:,i]).max(), 1e-12)
+            res.append(sqrt(self.smoothness[i])*diff(table[order,i])/scale)
+        return concatenate(res)
+
+    def jac_sparsity(self):
+        """sparsity pattern of the Jacobian of residuals()"""
+        K = len(self.spectra)
+        nrows = 0
+        for spectrum in self.spectra:
+            nrows += 2*len(spectrum[0])
+        nrows += len(self._smoothed)*(K - 1)
+        ncols = self._columns[-1][-1] + 1
+        S = lil_matrix((nrows, ncols), dtype=int)
+
+        row = 0
+        for k in range(K):
+            n = 2*len(self.spectra[k][0])
+            for i in range(len(self.modes)):
+                if (self.modes[i] == 'free'):
+                    S[row:row + n, self._columns[i][k]] = 1
+                else:
+                    for c in self._columns[i]:
+                        S[row:row + n, c] = 1
+            row += n
+
+        order = argsort(self.temperatures)
+        for i in self._smoothed:
+            for k in range(K - 1):
+                S[row, self._columns[i][order[k]]] = 1
+                S[row, self._columns[i][order[k + 1]]] = 1
+                row += 1
+        return S
+
+    def fit(self, verbose=True, max_nfev=None):
+        """fit all spectra at once
+
+        Afterwards self.table holds the (K x P) fitted parameters, self.RMS_errors the RMS error of each
+        spectrum, and model_at(k) gives a copy of the model with the parameters of spectrum k.
+        """
+        start_t = time.time()
+        (self._columns, x0, lb, ub) = self._layout()
+        self._smoothed = [i for i in range(len(self.modes)) if (self.modes[i] == 'free') and (self.smoothness[i] > 0)]
+
+        resultobject = optimize.least_squares(self.residuals, x0, bounds=(lb, ub), jac_sparsity=self.jac_sparsity(),
+                                              method='trf', x_scale='jac', max_nfev=max_nfev)
+        self.x = resultobject.x
+        self.table = self.values(self.x)
+        self.model.setparams(self.table[0])
+
+        self.RMS_errors = []
+        for k in range(len(self.spectra)):
+            (dataX, datarp, datacp) = self.spectra[k]
+            self.model.setparams(self.table[k])
+            (rp, cp) = self.model(dataX)
+            diffrp = (datarp - rp)/datarp
+            diffcp = (datacp - cp)/datacp
+            self.RMS_errors.append(sqrt((dot(diffrp, diffrp) + dot(diffcp, diffcp))/(2*len(dataX))))
+
+        end_t = time.time()
+        self.fit_report = {'nfev': resultobject.nfev, 'njev': resultobject.njev, 'cost': float(resultobject.cost),
+                           'ncoefficients': len(x0), 'time': end_t - start_t}
+        m, s = divmod(end_t - start_t, 60)
+        h, m = divmod(m, 60)
+        if (verbose == True):
+            print("least squares function evaluations = ", resultobject.nfev)
+            print("Series fit of %d spectra completed in %02d hr %02d min %02d sec" % (len(self.spectra), h, m, s))
+
+    def model_at(self, k):
+        """a copy of the model with the fitted parameters of spectrum k"""
+        model = deepcopy(self.model)
+        model.setparams(list(self.table[k]))
+        return model
+
+    def print_series(self):
+        """Write out a table of every parameter against temperature"""
+        names = self.model.getparamnames()
+        order = argsort(self.temperatures)
+        print("%32s" % "T =" + "".join(["%10.1f" % self.temperatures[k] for k in order]))
+        for i in range(len(names)):
+            mode = self.modes[i] if isinstance(self.modes[i], str) else "poly%d" % self.modes[i][1]
+            print("%20s %11s" % names[i] + "".join(["%10.4g" % self.table[k,i] for k in order]) + "  (%s)" % mode)
+        print("%32s" % "RMS error" + "".join(["%10.3f" % self.RMS_errors[k] for k in order]))
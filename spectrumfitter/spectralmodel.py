@@ -1,6 +1,11 @@
 from scipy import optimize 
 from numpy import *
 import time
+from .checkpoint import save_checkpoint, load_checkpoint, new_state
+from .checkpoint import differential_evolution as checkpointed_differential_evolution
+from .fitcache import FitCache, fit_key
+from .constraints import FSumConstraint, repair, checked_result
+from .surrogate import surrogate_minimize
 
 class SpectralModel: 
     """A spectralmodel object is simply a list of lineshape objects"""
@@ -9,6 +14,7 @@ class SpectralModel:
         self.lineshapes = lineshapes
         self.numlineshapes = 0
         self.RMS_error = 0 
+        self.fit_report = {}
         
     def add(self,lineshape):
         """add a new lineshape object to the spectral model's list of lineshapes"""
@@ -37,6 +43,18 @@ class SpectralModel:
             bounds = bounds + lineshape.bounds
         return bounds
     
+    def getparamnames(self):
+        """get (lineshape name, parameter name) pairs for all the parameters in a model and return as list"""
+        names = []
+        for lineshape in self.lineshapes:
+            pnames = getattr(lineshape, "pnames", [])
+            for j in range(len(lineshape.p)):
+                if j < len(pnames):
+                    names.append((lineshape.name, pnames[j]))
+                else:
+                    names.append((lineshape.name, "p%d" % j))
+        return names
+    
     def getfreqs(self):
         """get frequencies for all the lineshapes in a model and return as list"""
         freqs = zeros(self.numlineshapes)
@@ -46,15 +64,75 @@ class SpectralModel:
             freqs[i] = self.lineshapes[i].p[1]
         return freqs
     
-    def fsum(self):
-        """evaluate the f-sum rule (sum the oscillator strengths)"""
-        fsum = 0 
-        for i in range(self.numlineshapes):
-            if (self.lineshapes[i].p[0] == "BrendelDHO"): 
-                fsum = fsum + self.lineshapes[i].f
+    def compile(self):
+        """group the lineshapes by type for vectorized evaluation
+
+        Lineshape classes with a grouped(P, w) method are collected into groups of the same class and number
+        of parameters. Each group is stored as a (K x m) matrix of indices into the flat parameter list, so
+        its K lineshapes are evaluated with one broadcasted (K x N) expression. Other lineshapes are called
+        one at a time. The index arrays for fsum() and glst_arrays() are built at the same time.
+        The result is cached and rebuilt automatically when lineshapes are added, removed or replaced, or
+        change their type or number of parameters. The cache holds the lineshape objects themselves, so a
+        new lineshape can never be mistaken for a freed one that had the same id.
+        """
+        compiled = getattr(self, "_compiled", None) #models pickled before this existed have no cache
+        if (compiled is not None) and (compiled.get('layout') is not None) and (len(compiled['layout']) == len(self.lineshapes)):
+            for ((lineshape, ltype, m), l) in zip(compiled['layout'], self.lineshapes):
+                if (l is not lineshape) or (type(l) is not ltype) or (len(l.p) != m):
+                    break
+            else:
+                return compiled
+
+        groups = {}
+        fallback = []
+        strength = []
+        relax = []
+        osc = []
+        offset = 0
+        for lineshape in self.lineshapes:
+            m = len(lineshape.p)
+            grouped = getattr(type(lineshape), "grouped", None)
+            if (grouped is None):
+                fallback.append(lineshape)
             else:
-                fsum = fsum + self.lineshapes[i].p[0]
-        return fsum
+                groups.setdefault((grouped, m), []).append(list(range(offset, offset + m)))
+            strength.append(offset)
+            ltype = getattr(lineshape, "type", None)
+            if (ltype == "Debye"):
+                relax.append(offset + 1)
+            if (ltype == "DHO") or (ltype == "VanVleck") or (ltype == "BrendelDHO"):
+                osc.append((offset + 1, offset + 2))
+            offset += m
+
+        self._compiled = {'layout': [(l, type(l), len(l.p)) for l in self.lineshapes],
+                          'groups': [(grouped, array(rows, dtype=int)) for ((grouped, m), rows) in groups.items()],
+                          'fallback': fallback,
+                          'strength': array(strength, dtype=int),
+                          'relax': array(relax, dtype=int),
+                          'osc': array(osc, dtype=int).reshape(-1, 2)}
+        return self._compiled
+
+    def fsum(self):
+        """evaluate the f-sum rule (sum the oscillator strengths, the first parameter of every lineshape)"""
+        compiled = self.compile()
+        return array(self.getparams(), dtype=float)[compiled['strength']].sum()
+
+    def strength_indices(self):
+        """indices of the oscillator strengths (summed by fsum) in the list returned by getparams"""
+        return self.compile()['strength']
+
+    def glst_indices(self):
+        """indices used in the gLST relation, in the list returned by getparams: (relaxation frequencies of the
+        Debye-type lineshapes, K x 2 array of the frequencies and damping constants of the oscillators)"""
+        compiled = self.compile()
+        return (compiled['relax'], compiled['osc'])
+
+    def glst_arrays(self):
+        """arrays used in the gLST relation: (relaxation frequencies of the Debye-type lineshapes,
+        frequencies and damping constants of the DHO, VanVleck and BrendelDHO lineshapes)"""
+        (relax, osc) = self.glst_indices()
+        params = array(self.getparams(), dtype=float)
+        return (params[relax], params[osc[:,0]], params[osc[:,1]])
                 
     def __call__(self,w):
         """compute real and complex parts of the spectral_model model at frequencies in array w
@@ -64,9 +142,16 @@ class SpectralModel:
         returns: 
             (rp, cp) a list with rp and cp as 1xN arrays  
         """
+        compiled = self.compile()
+        w = asarray(w, dtype=float)
+        params = array(self.getparams(), dtype=float)
         rp = zeros(len(w))    
         cp = zeros(len(w)) 
-        for lineshape in self.lineshapes:
+        for (grouped, rows) in compiled['groups']:
+            (rpPart, cpPart) = grouped(params[rows], w)
+            rp = rp + rpPart
+            cp = cp + cpPart
+        for lineshape in compiled['fallback']:
             (rpPart, cpPart) = lineshape(w)
             rp = rp + rpPart
             cp = cp + cpPart
@@ -100,62 +185,234 @@ class SpectralModel:
         print("     \\end{tabular}}")
         print("\\end{table}")
     
-    def fit_model(self, dataX, datarp, datacp, differential_evolution=True, TNC=True, SLSQP=True, verbose=True):
-        '''Fit the function using one or multiple optimization methods in serial''' 
-    
-        def diffsq(params):
-            self.setparams(params)
-            
-            (rp,cp) = self(dataX)
-            
-            diffrp = (datarp - rp)/datarp
-            diffcp = (datacp - cp)/datacp 
-            
-            #Ldatacp = datacp/(datarp**2 + datacp**2)
-            #Lfitcp =  cp/(rp**2 + cp**2)
-            #diffLcp = (Ldatacp - Lfitcp)/Ldatacp
-            
-            return dot(diffcp, diffcp) + dot(diffrp, diffrp) #+ dot(diffLcp,diffLcp)
+    def fit_model(self, dataX, datarp, datacp, differential_evolution=True, TNC=True, SLSQP=True, verbose=True, seed=None, checkpoint=None, checkpoint_every=10, resume=False, cache=None, callback=None,
+                  constraints=None, trust_constr=False, local_maxiter=None, surrogate=False, surrogate_options=None):
+        '''Fit the function using one or multiple optimization methods in serial
 
-        def costfun(params):
-            """Wrapper function neede for the optimization method
-
-            Args: 
-                params: a list of parameters for the model
-            Returns: 
-                The cost (real scalar)
-            """
-            Error = diffsq(params) 
-            
-            fsumpenalty = datarp[0] - self.fsum()
-            
-            return Error + fsumpenalty**2 
+        args:
+            dataX, datarp, datacp: 1xN arrays with the frequencies and the real and complex parts of the data
+            differential_evolution, TNC, SLSQP: which optimization stages to run, in this order
+            verbose: print the number of iterations of each stage and the total time
+            seed: integer seed for differential evolution, makes the fit reproducible
+            checkpoint: file name to periodically write the fit state to (None = no checkpoints)
+            checkpoint_every: number of differential evolution generations between checkpoints
+            resume: continue from the state in the checkpoint file if it exists. A checkpoint written by a fit with
+                    different data, starting parameters, bounds or options raises a ValueError.
+            cache: a FitCache (or a directory name for one); an identical earlier fit is restored from it
+            callback: function called as callback(stage, params, cost) after every DE generation and every
+                      iteration of the local optimizers, where stage is 'differential_evolution', 'surrogate', 'TNC',
+                      'SLSQP' or 'trust-constr'.
+                      An exception raised by the callback aborts the fit.
+            constraints: list of Constraint objects (see constraints.py), or 'fsum' for the f-sum rule
+                         FSumConstraint(self, datarp[0]). They replace the f-sum penalty in the cost: SLSQP and
+                         trust-constr satisfy them exactly, DE and TNC evaluate the cost at repaired points.
+            trust_constr: add a final trust-constr stage after SLSQP (most useful with constraints)
+            local_maxiter: budget of each local stage, the maximum number of function evaluations for TNC and of
+                           iterations for SLSQP and trust-constr (None = the optimizers' defaults)
+            surrogate: run the surrogate-assisted search of surrogate.py as the global stage instead of differential
+                       evolution, for models that are expensive to evaluate. It needs finite bounds.
+            surrogate_options: dictionary of options for surrogate_minimize (eg. maxevals, batch, processes); a seed
+                               there takes the place of seed, and a callback there is called after callback
 
+        Afterwards self.fit_report holds the number of iterations of each stage, the final cost and the time taken.
+        With constraints, if SLSQP or trust-constr fail or end outside the constraints, the fit carries on from the
+        repaired result or the repaired starting point of that stage (see constraints.checked_result) and
+        fit_report['warnings'] says why.
+        '''
+    
         start_t = time.time()
 
         params = self.getparams()
         bounds = self.getbounds()
 
-        if (differential_evolution == True):
-            resultobject = optimize.differential_evolution(costfun,bounds,maxiter=2000)  
+        if (constraints == 'fsum'):
+            constraints = [FSumConstraint(self, datarp[0])]
+
+        costfun = FitCost(self, dataX, datarp, datacp, constraints, bounds)
+        diffsq = costfun.diffsq
+        local_costfun = costfun if (constraints is None) else costfun.repaired
+
+        options = {'differential_evolution': differential_evolution, 'TNC': TNC, 'SLSQP': SLSQP, 'seed': seed}
+        if (constraints is not None):
+            options['constraints'] = [repr(c) for c in constraints]
+        if (trust_constr == True):
+            options['trust_constr'] = True
+        if (local_maxiter is not None):
+            options['local_maxiter'] = local_maxiter
+        if (surrogate == True):
+            options['surrogate'] = repr(sorted((surrogate_options or {}).items()))
+        key = fit_key(self, dataX, datarp, datacp, options) #identifies this fit in the cache and in checkpoints
+
+        if (cache is not None):
+            if not isinstance(cache, FitCache):
+                cache = FitCache(cache)
+            entry = cache.get(key)
+            if (entry is not None):
+                self.setparams(entry['params'])
+                self.RMS_error = entry['RMS_error']
+                self.fit_report = dict(entry['fit_report'], cached=True)
+                if (verbose == True): print("Fit restored from cache")
+                return
+
+        report = {'nit': {}, 'cached': False}
+
+        state = None
+        if (resume == True) and (checkpoint is not None):
+            state = load_checkpoint(checkpoint, bounds, fingerprint=key)
+        if (state is None):
+            state = new_state(params, bounds, fingerprint=key)
+        else:
+            params = state['params']
+            if (verbose == True): print("Resuming fit from checkpoint %s at stage %d" % (checkpoint, state['stage']))
+
+        def finish_stage(stage, params):
+            state['stage'] = stage
+            state['params'] = list(params)
+            if (checkpoint is not None): save_checkpoint(checkpoint, state)
+
+        def stage_callback(stage):
+            if (callback is None):
+                return None
+            if (stage == 'trust-constr'): #trust-constr passes the optimizer state as well
+                return lambda xk, optstate: callback(stage, list(xk), costfun(xk))
+            return lambda xk: callback(stage, list(xk), costfun(xk))
+
+        def local_options(name):
+            return {} if (local_maxiter is None) else {name: local_maxiter}
+
+        if (surrogate == True) and (state['stage'] < 1):
+            search_options = dict(surrogate_options or {})
+            search_options.setdefault('seed', seed)
+            user_callback = search_options.get('callback')
+            def surrogate_callback(x, cost):
+                if (callback is not None): callback('surrogate', list(x), cost)
+                return (user_callback is not None) and (user_callback(x, cost) == True)
+            search_options['callback'] = surrogate_callback
+            resultobject = surrogate_minimize(local_costfun, bounds, **search_options)
+            params = list(resultobject.x)
+            if (constraints is not None): params = list(repair(constraints, params, bounds))
+            report['nit']['surrogate'] = resultobject.nit
+            report['nfev'] = {'surrogate': resultobject.nfev}
+            if (verbose == True): print("surrogate search number of cost evaluations = ", resultobject.nfev)
+        elif (differential_evolution == True) and (state['stage'] < 1):
+            resultobject = checkpointed_differential_evolution(local_costfun, bounds, maxiter=2000, seed=seed, state=state, checkpoint=checkpoint, checkpoint_every=checkpoint_every, callback=callback)
+            params = list(resultobject.x) #each stage starts from the previous stage's optimum
+            if (constraints is not None): params = list(repair(constraints, params, bounds))
+            report['nit']['differential_evolution'] = resultobject.nit
             if (verbose == True): print("diff. evolv. number of iterations = ", resultobject.nit)
+        finish_stage(1, params)
 
-        if (TNC == True):
-            resultobject = optimize.minimize(costfun, x0=params, bounds=bounds, method='TNC')
+        if (TNC == True) and (state['stage'] < 2):
+            resultobject = optimize.minimize(local_costfun, x0=params, bounds=bounds, method='TNC', callback=stage_callback('TNC'),
+                                             options=local_options('maxfun'))
+            params = list(resultobject.x)
+            if (constraints is not None): params = list(repair(constraints, params, bounds))
+            report['nit']['TNC'] = resultobject.nit
             if (verbose == True): print("TNC number of iterations = ", resultobject.nit)
+        finish_stage(2, params)
         
-        if (SLSQP == True):
-            resultobject = optimize.minimize(costfun, x0=params, bounds=bounds, method='SLSQP')
+        if (SLSQP == True) and (state['stage'] < 3):
+            slsqp_constraints = [] if (constraints is None) else [c.as_dict() for c in constraints]
+            resultobject = optimize.minimize(costfun, x0=params, bounds=bounds, method='SLSQP', constraints=slsqp_constraints,
+                                             callback=stage_callback('SLSQP'), options=local_options('maxiter'))
+            if (constraints is not None):
+                (x, message) = checked_result(resultobject, params, constraints, bounds, costfun)
+                params = list(x)
+                if (message is not None):
+                    report.setdefault('warnings', {})['SLSQP'] = message
+                    if (verbose == True): print("SLSQP failed: %s" % message)
+            else:
+                params = list(resultobject.x)
+            report['nit']['SLSQP'] = resultobject.nit
             if (verbose == True): print("SLSQP number of iterations = ", resultobject.nit)
+        finish_stage(3, params)
+
+        if (trust_constr == True) and (state['stage'] < 4):
+            nonlinear = [] if (constraints is None) else [c.as_nonlinear() for c in constraints]
+            resultobject = optimize.minimize(costfun, x0=params, bounds=bounds, method='trust-constr', constraints=nonlinear,
+                                             callback=stage_callback('trust-constr'), options=local_options('maxiter'))
+            if (constraints is not None):
+                (x, message) = checked_result(resultobject, params, constraints, bounds, costfun)
+                params = list(x)
+                if (message is not None):
+                    report.setdefault('warnings', {})['trust-constr'] = message
+                    if (verbose == True): print("trust-constr failed: %s" % message)
+            else:
+                params = list(resultobject.x)
+            report['nit']['trust-constr'] = resultobject.nit
+            if (verbose == True): print("trust-constr number of iterations = ", resultobject.nit)
+        finish_stage(4, params)
 
         #mybounds = MyBounds(bounds=array(bounds))
         #ret = basinhopping(diffsq, params, niter=10,accept_test=mybounds)
 
-        params = self.getparams() #get updated params
+        self.setparams(params) #leave the model at the optimum, not the last trial point
         
         end_t = time.time()
         m, s = divmod(end_t - start_t, 60)
         h, m = divmod(m, 60)
-        print("Fit completed in %02d hr %02d min %02d sec" % (h, m, s))
+        if (verbose == True): print("Fit completed in %02d hr %02d min %02d sec" % (h, m, s))
+
+        report['cost'] = float(costfun(params))
+        report['time'] = end_t - start_t
+        self.fit_report = report
+
+        self.RMS_error = sqrt(diffsq(params)/(2*len(dataX))) #Store RMS error
+
+        if (cache is not None):
+            cache.put(key, {'params': list(params), 'RMS_error': self.RMS_error, 'fit_report': report})
+
+
+class FitCost:
+    """The cost minimized by SpectralModel.fit_model, as an object that can be pickled and so evaluated
+    in worker processes (each process then works on its own copy of the model)
+
+    args:
+        model: the SpectralModel; calling the cost sets its parameters
+        dataX, datarp, datacp: the data
+        constraints: list of Constraint objects, which replace the f-sum penalty (None = use the penalty)
+        bounds: the parameter bounds, needed by repaired()
+    """
+    def __init__(self, model, dataX, datarp, datacp, constraints=None, bounds=None):
+        self.model = model
+        self.dataX = dataX
+        self.datarp = datarp
+        self.datacp = datacp
+        self.constraints = constraints
+        self.bounds = bounds
+
+    def diffsq(self, params):
+        '''sum of the squared relative residuals of the real and complex parts'''
+        self.model.setparams(params)
+        
+        (rp,cp) = self.model(self.dataX)
+        
+        diffrp = (self.datarp - rp)/self.datarp
+        diffcp = (self.datacp - cp)/self.datacp 
+        
+        #Ldatacp = datacp/(datarp**2 + datacp**2)
+        #Lfitcp =  cp/(rp**2 + cp**2)
+        #diffLcp = (Ldatacp - Lfitcp)/Ldatacp
+        
+        return dot(diffcp, diffcp) + dot(diffrp, diffrp) #+ dot(diffLcp,diffLcp)
+
+    def __call__(self, params):
+        """Wrapper function neede for the optimization method
+
+        Args: 
+            params: a list of parameters for the model
+        Returns: 
+            The cost (real scalar)
+        """
+        Error = self.diffsq(params) 
+
+        if (self.constraints is not None): #the sum rules are imposed by the optimizers, not by a penalty
+            return Error
+        
+        fsumpenalty = self.datarp[0] - self.model.fsum()
+        
+        return Error + fsumpenalty**2 
 
-        self.RMS_error = sqrt(diffsq(params)/(2*len(dataX))) #Store RMS error
\ No newline at end of file
+    def repaired(self, params):
+        '''the cost at params moved onto the constraints (see Constraint.repair)'''
+        return self(repair(self.constraints, params, self.bounds))
@@ -5,6 +5,9 @@ from numpy import *
 import matplotlib.pyplot as plt
 from scipy import optimize 
 from scipy import special as sp
+from .checkpoint import save_checkpoint, load_checkpoint, new_state
+from .constraints import FSumConstraint, GLSTConstraint, repair, checked_result
+from .fitcache import fit_key, model_signature
 
 class Lineshape:
     """Class that holds some things common to all Lineshapes""" 
@@ -27,6 +30,16 @@ class Debye(Lineshape):
         cp = rp*w/self.p[1]
         return (rp, cp)
     
+    @staticmethod
+    def grouped(P, w):
+        '''summed (rp, cp) of K Debye lineshapes with parameters in the rows of the (K x 2) array P'''
+        f  = P[:,0]
+        wD = P[:,1]
+        inv = 1/((wD**2)[:,newaxis] + w**2)
+        rp = dot(f*wD**2, inv)
+        cp = w*dot(f*wD, inv)
+        return (rp, cp)
+    
     def get_freq(self): 
         return self.p[1]
     
@@ -53,6 +66,19 @@ class DHO(Lineshape):
         cp = self.p[0]*(self.p[1]**2)*self.p[2]*w/denom
         return (rp, cp)
     
+    @staticmethod
+    def grouped(P, w):
+        '''summed (rp, cp) of K DHO lineshapes with parameters in the rows of the (K x 3) array P'''
+        f  = P[:,0]
+        w0 = P[:,1]
+        g  = P[:,2]
+        w2 = w**2
+        d = (w0**2)[:,newaxis] - w2
+        inv = 1/(d*d + (g**2)[:,newaxis]*w2)
+        rp = dot(f*w0**2, d*inv)
+        cp = w*dot(f*w0**2*g, inv)
+        return (rp, cp)
+    
     def get_freq(self):
         return self.p[1]
     
@@ -86,6 +112,19 @@ class BrendelDHO(Lineshape):
         self.f = eps.real[1]
         return (eps.real, eps.imag)
     
+    @staticmethod
+    def grouped(P, w):
+        '''summed (rp, cp) of K Brendel lineshapes with parameters in the rows of the (K x 4) array P'''
+        sigma = P[:,3:4]
+        x0 = P[:,1:2]
+        g  = P[:,2:3]
+        a = sqrt(w**2 - 1j*g*w) 
+        a = a.real - 1j*a.imag
+        prefac = 1j*sqrt(3.14149)*P[:,0:1]*x0**2/(sqrt(22)*sigma)
+        eps = prefac*exp(-.5)*(1/a)*( sp.erfcx(-1j*(a-x0)/sigma) +  sp.erfcx(-1j*(a+x0)/sigma) )
+        eps = eps.sum(axis=0)
+        return (eps.real, eps.imag)
+    
     def get_freq(self):
         return self.p[1]
     
@@ -209,6 +248,8 @@ class ColeCole(Lineshape):
         cp = rp*w/self.p[1]
         return (rp, cp)
     
+    grouped = staticmethod(Debye.grouped) #alpha is not used by __call__ either
+    
     def get_freq(self): 
         return self.p[1]
     
@@ -276,6 +317,11 @@ class constant(Lineshape):
         cp = 0*w
         return (rp, cp)
     
+    @staticmethod
+    def grouped(P, w):
+        '''summed (rp, cp) of K constants in the (K x 1) array P'''
+        return (0*w + P[:,0].sum(), 0*w)
+    
     def print_params(self):
         print("%20s f =%7.5f" % (self.name, self.p[0]))
     
@@ -283,8 +329,19 @@ class constant(Lineshape):
         print("%20s & %7.5f & & & & \\\\" % (self.name, self.p[0]))
 
 #-----------------------------------------------------------------------------------------------------------
-def fit_model_gLST_constraint(modelL, modelT, dataX, Tdatarp, Tdatacp):
-        ''' fit both the transverse and longitudinal models at the same time with the gLST constraint  '''
+def fit_model_gLST_constraint(modelL, modelT, dataX, Tdatarp, Tdatacp, checkpoint=None, resume=False, exact=False):
+        ''' fit both the transverse and longitudinal models at the same time with the gLST constraint
+
+        The state is written to the file checkpoint (if given) after each optimization stage, and with
+        resume=True a fit continues from the last completed stage in that file (a checkpoint of a fit with
+        different data or starting parameters raises a ValueError).
+
+        With exact=True the f-sum rule and the gLST relation are passed to SLSQP as equality constraints
+        (FSumConstraint and GLSTConstraint) instead of being added to the cost as penalties, so the fitted
+        models satisfy them exactly. TNC then works on the repaired cost (see constraints.py). If SLSQP fails or
+        ends outside the constraints, the repaired result or the repaired TNC result is kept instead. Without
+        exact the optimizer results are used as they are.
+        '''
 
         Ldatarp = 1.0 - Tdatarp/(Tdatarp**2 + Tdatacp**2)
         Ldatacp = Tdatacp/(Tdatarp**2 + Tdatacp**2)
@@ -324,6 +381,9 @@ def fit_model_gLST_constraint(modelL, modelT, dataX, Tdatarp, Tdatacp):
             gLST_RHS = eps0/eps_inf
                         
             gLSTpenalty = ( gLST_LHS(modelL, modelT) - gLST_RHS )**2
+
+            if (exact == True):
+                return diffsq(paramsL, paramsT)
             
             #print(diffsq(paramsL, paramsT) , gLSTpenalty , 100*fsumpenalty)
             
@@ -341,19 +401,57 @@ def fit_model_gLST_constraint(modelL, modelT, dataX, Tdatarp, Tdatacp):
         
         assert len(boundsL) == len(boundsT)
         assert len(params) == len(bounds)
-    
-        resultobject = optimize.minimize(costfun, x0=params, bounds=bounds, method='TNC')
-        print("number of iterations = ", resultobject.nit)
+
+        constraints = []
+        if (exact == True):
+            eps0 = Tdatarp[0]
+            eps_inf = Tdatarp[-1]
+            constraints = [FSumConstraint(modelT, eps0, offset=len(Lparams)),
+                           GLSTConstraint(modelL, modelT, eps0/eps_inf, offsetL=0, offsetT=len(Lparams))]
+
+        def repaired_costfun(params):
+            return costfun(list(repair(constraints, params, bounds)))
+
+        #identifies this fit, so a checkpoint of a different one is never resumed
+        key = fit_key(modelL, dataX, Tdatarp, Tdatacp, {'modelT': (model_signature(modelT), repr([float(x) for x in Tparams])), 'exact': exact})
+
+        state = None
+        if (resume == True) and (checkpoint is not None):
+            state = load_checkpoint(checkpoint, bounds, fingerprint=key)
+        if (state is None):
+            state = new_state(params, bounds, fingerprint=key)
+        else:
+            params = state['params']
+            print("Resuming fit from checkpoint %s at stage %d" % (checkpoint, state['stage']))
+
+        def finish_stage(stage, params):
+            state['stage'] = stage
+            state['params'] = list(params)
+            if (checkpoint is not None): save_checkpoint(checkpoint, state)
+    
+        if (state['stage'] < 1):
+            resultobject = optimize.minimize(repaired_costfun if (exact == True) else costfun, x0=params, bounds=bounds, method='TNC')
+            params = list(repair(constraints, resultobject.x, bounds)) if (exact == True) else list(resultobject.x)
+            print("number of iterations = ", resultobject.nit)
+            finish_stage(1, params)
         
-        resultobject = optimize.minimize(costfun, x0=params, bounds=bounds, method='SLSQP')
-        print("number of iterations = ", resultobject.nit)
+        if (state['stage'] < 2):
+            resultobject = optimize.minimize(costfun, x0=params, bounds=bounds, method='SLSQP', constraints=[c.as_dict() for c in constraints])
+            if (exact == True):
+                (x, message) = checked_result(resultobject, params, constraints, bounds, costfun)
+                params = list(x)
+                if (message is not None): print("SLSQP failed: %s" % message)
+            else:
+                params = list(resultobject.x)
+            print("number of iterations = ", resultobject.nit)
+            finish_stage(2, params)
 
         
         #optimize.fmin_l_bfgs_b(costfun, bounds=bounds)
         #optimize.differential_evolution(costfun, bounds)  
     
-        Lparams = modelL.getparams()
-        Tparams = modelT.getparams()
+        Lparams = params[0:len(params)//2]
+        Tparams = params[len(params)//2:]
         
         print("RMS error = ",sqrt(diffsq(Lparams, Tparams)))
 
@@ -383,24 +481,13 @@ def print_gLST_ratios(modelL, modelT):
 def gLST_LHS(modelL,modelT):
     '''calculate the left hand side of the GLST equation'''
 
-    numerator   = ones(modelL.numlineshapes)
-    denominator = ones(modelT.numlineshapes)
-    
-    for i in range(modelL.numlineshapes):
-        if modelL.lineshapes[i].type == "Debye":
-            numerator[i] = modelL.lineshapes[i].p[1]
+    (Lrelax, Lw, Lgamma) = modelL.glst_arrays()
+    (Trelax, Tw, Tgamma) = modelT.glst_arrays()
 
-        if (modelL.lineshapes[i].type == "DHO") or (modelL.lineshapes[i].type == "VanVleck") or (modelL.lineshapes[i].type == "BrendelDHO"):             
-            numerator[i] = (modelL.lineshapes[i].p[1]**2 + modelL.lineshapes[i].p[2]**2)
-            
-    for i in range(modelT.numlineshapes):
-        if modelT.lineshapes[i].type == "Debye":
-            denominator[i] = modelT.lineshapes[i].p[1]
+    numerator   = prod(Lrelax)*prod(Lw**2 + Lgamma**2)
+    denominator = prod(Trelax)*prod(Tw**2)
 
-        if (modelT.lineshapes[i].type == "DHO") or (modelT.lineshapes[i].type == "VanVleck") or (modelT.lineshapes[i].type == "BrendelDHO"):             
-            denominator[i] = modelT.lineshapes[i].p[1]**2
-            
-    return prod(numerator)/prod(denominator)
+    return numerator/denominator
     
 
 ##----------------------------------------------------------------------------------
@@ -423,6 +510,61 @@ def print_gLST_LHS_stuff(modelL, modelT, Tdatarp, Tdatacp):
     print("LST RHS = %6.2f" %  gLST_RHS)
 
     
+#-------------------------------------------------------------------------------------------------------------
+def load_spectrum(fname, min_freq=None, max_freq=None, fmt=None):
+    """load a spectrum from a text file
+
+    args:
+        fname: file name
+        min_freq, max_freq: only keep frequencies in this range
+        fmt: 'RI' for columns (frequency, n, k), converted to the dielectric function eps = (n + ik)**2,
+             'eps' for columns (frequency, real part, complex part),
+             'intensity' for columns (frequency, intensity), eg. a Raman spectrum; the intensity is returned as both parts.
+             The default is 'RI' for files ending in .RI, otherwise 'eps' or 'intensity' depending on the number of columns.
+    returns:
+        (omegas, rp, cp) as 1xN arrays
+    """
+    data = loadtxt(fname=fname, ndmin=2)
+    if (fmt == None) and fname.upper().endswith(".RI"):
+        fmt = 'RI'
+    return parse_spectrum(data, fmt, min_freq, max_freq)
+
+def parse_spectrum(data, fmt=None, min_freq=None, max_freq=None):
+    """convert an array of data columns to a spectrum, as load_spectrum does for the contents of a file
+
+    args:
+        data: a 2D array with one row per frequency
+        fmt: 'RI', 'eps' or 'intensity' (see load_spectrum); the default is 'eps' or 'intensity' depending on the number of columns
+        min_freq, max_freq: only keep frequencies in this range
+    returns:
+        (omegas, rp, cp) as 1xN arrays
+    """
+    data = atleast_2d(asarray(data, dtype=float))
+    if (fmt == None):
+        if (data.shape[1] == 2):
+            fmt = 'intensity'
+        else:
+            fmt = 'eps'
+
+    keep = ones(len(data), dtype=bool)
+    if (min_freq != None):
+        keep = keep & (data[:,0] >= min_freq)
+    if (max_freq != None):
+        keep = keep & (data[:,0] <= max_freq)
+    data = data[keep]
+    omegas = data[:,0]
+
+    if (fmt == 'RI'):
+        n = data[:,1]
+        k = data[:,2]
+        return (omegas, n**2 - k**2, 2*n*k)
+    elif (fmt == 'eps'):
+        return (omegas, data[:,1], data[:,2])
+    elif (fmt == 'intensity'):
+        return (omegas, data[:,1], data[:,1])
+    else:
+        raise ValueError("unknown spectrum format '%s', use 'RI', 'eps' or 'intensity'" % fmt)
+
 #-------------------------------------------------------------------------------------------------------------
 def plot_model(model,dataX,dataYrp,dataYcp,Myhandle,xmin=None,xmax=None,xscale='linear',yscale='log',ymin=None,ymax=None,show=False,Block=True,longitudinal=False,title='',peaks=[]):
     """displays a pretty plot of the real and complex parts of the model and data using matplotlib
@@ -0,0 +1,241 @@
+''' streaming.py : follow continuously acquired spectra and refit a model to each one as it arrives '''
+from numpy import *
+import fnmatch
+import os
+import queue
+import threading
+import time
+from .spectrumfitter import load_spectrum, parse_spectrum
+
+
+def watch_directory(directory, pattern='*', poll_interval=1.0, timeout=None, stop=None, **load_options):
+    """generator of the spectra in a directory, including files that are added to it later
+
+    Files already in the directory come first, in order of name, then new files in the order they appear.
+    A file is read once its size and modification time have not changed between two polls, so files that
+    are still being written are not read half finished. Each file is yielded once. A file that cannot be read
+    is yielded as (fname, error) with the exception instead of the data, and the watch goes on.
+
+    args:
+        directory: the directory to watch
+        pattern: only files matching this shell pattern are read (eg. '*.RI')
+        poll_interval: seconds between checks for new files
+        timeout: stop when no new file has appeared for this many seconds (None = never)
+        stop: optional threading.Event, the generator returns once it is set
+        load_options: passed to load_spectrum (fmt, min_freq, max_freq)
+    yields:
+        (fname, omegas, rp, cp) for every file, or (fname, error) for a file that could not be read
+    """
+    done = set()
+    pending = {}
+    last_t = time.time()
+    while not ((stop is not None) and stop.is_set()):
+        found = False
+        for name in sorted(os.listdir(directory)):
+            fname = os.path.join(directory, name)
+            if (fname in done) or not fnmatch.fnmatch(name, pattern) or not os.path.isfile(fname):
+                continue
+            try:
+                st = os.stat(fname)
+            except OSError: #removed since the listing
+                pending.pop(fname, None)
+                continue
+            if (pending.get(fname) != (st.st_size, st.st_mtime)):
+                pending[fname] = (st.st_size, st.st_mtime) #read it at the next poll if it has not changed
+                continue
+            del pending[fname]
+            done.add(fname)
+            found = True
+            try:
+                (omegas, rp, cp) = load_spectrum(fname, **load_options)
+            except Exception as e:
+                yield (fname, e)
+                continue
+            yield (fname, omegas, rp, cp)
+        if (found == True) or (len(pending) > 0):
+            last_t = time.time()
+        elif (timeout is not None) and (time.time() - last_t > timeout):
+            return
+        time.sleep(poll_interval)
+
+
+def tail_file(fname, fmt=None, min_freq=None, max_freq=None, accumulate=False, poll_interval=1.0, timeout=None, stop=None):
+    """generator of the spectra appended to a text file
+
+    The file holds blocks of rows in one of the load_spectrum formats, each block ended by a blank line.
+    The file is read as it grows and every completed block is yielded, either as a spectrum of its own or,
+    with accumulate=True, added to the blocks before it as a further frequency range of one spectrum (the
+    spectrum so far is yielded after each block). Lines starting with '#' are ignored. The file does not
+    have to exist yet. When the generator stops, a final block without the closing blank line is still
+    yielded, so nothing that was written is dropped. A block that cannot be parsed is yielded as
+    ('fname:block', error) with the exception instead of the data (and left out of an accumulated spectrum).
+
+    args:
+        fname: the file to follow
+        fmt, min_freq, max_freq: as for load_spectrum (fmt 'RI' is used by default for files ending in .RI)
+        accumulate: treat the blocks as successive frequency ranges of one spectrum
+        poll_interval: seconds between checks for new data
+        timeout: stop when no data has been appended for this many seconds (None = never)
+        stop: optional threading.Event, the generator returns once it is set
+    yields:
+        ('fname:block', omegas, rp, cp), where block counts the blocks from 0, or ('fname:block', error)
+    """
+    if (fmt == None) and fname.upper().endswith(".RI"):
+        fmt = 'RI'
+    position = 0
+    partial = ''
+    rows = []
+    collected = []
+    block = 0
+    bad = [None] #the first error in the current block
+    last_t = time.time()
+
+    def add_row(line):
+        try:
+            rows.append([float(v) for v in line.replace(',', ' ').split()])
+        except ValueError as e:
+            if (bad[0] is None): bad[0] = e
+
+    def spectrum(rows):
+        name = "%s:%d" % (fname, block)
+        try:
+            if (bad[0] is not None):
+                raise bad[0]
+            data = array((collected + rows) if accumulate else rows, dtype=float)
+            data = data[argsort(data[:,0], kind='stable')]
+            result = (name,) + parse_spectrum(data, fmt, min_freq, max_freq)
+        except Exception as e:
+            bad[0] = None
+            return (name, e)
+        if accumulate:
+            collected.extend(rows)
+        return result
+
+    while True:
+        stopped = (stop is not None) and stop.is_set()
+        text = ''
+        if os.path.exists(fname):
+            with open(fname) as f:
+                f.seek(position)
+                text = f.read()
+                position = f.tell()
+        if (len(text) > 0):
+            last_t = time.time()
+        lines = (partial + text).split('\n')
+        partial = lines.pop() #an unfinished last line is kept until it is completed
+        for line in lines:
+            line = line.strip()
+            if line.startswith('#'):
+                continue
+            if (line == ''):
+                if (len(rows) > 0) or (bad[0] is not None):
+                    yield spectrum(rows)
+                    block += 1
+                    rows = []
+            else:
+                add_row(line)
+
+        timed_out = (timeout is not None) and (time.time() - last_t > timeout)
+        if stopped or timed_out:
+            if (partial.strip() != '') and not partial.strip().startswith('#'):
+                add_row(partial)
+            if (len(rows) > 0) or (bad[0] is not None):
+                yield spectrum(rows)
+            return
+        time.sleep(poll_interval)
+
+
+_END = object()
+
+
+def refit_stream(model, spectra, queue_size=4, local_maxiter=50, stop=None, **fit_options):
+    """refit model to every spectrum from a source as it arrives, warm started from the previous solution
+
+    The spectra are read from the source on a background thread into a queue of at most queue_size spectra.
+    Each one is fit with the local optimizers only (no differential evolution) and a budget of local_maxiter
+    (see fit_model), starting from the model's current parameters, ie. the solution for the previous
+    spectrum, so every update takes a short and predictable time. The model should already be fit to a
+    representative spectrum before the stream starts.
+
+    When the fits fall behind, the queue fills up and the reading thread waits, so the source is not read
+    any further until there is room again: the backlog stays bounded and no spectrum is skipped or dropped.
+    For watch_directory and tail_file the waiting data simply stays on disk. The stop event is set when the
+    stream is closed (eg. when the consumer stops iterating), so that a source created with it, such as
+    watch_directory without a timeout, returns and the reading thread does not stay blocked in it. Either
+    pass spectra as a function of the event, eg. lambda stop: watch_directory(path, stop=stop), or create
+    the source with an event of your own and pass that as stop.
+
+    A spectrum that the source could not read (yielded as (name, error)) or that fails to fit gives a dict with
+    an 'error' key instead of the results, as cli.fit_file does, and the stream carries on with the next one;
+    after a failed fit the model goes back to the solution before it.
+
+    args:
+        model: the SpectralModel to refit; it holds the latest solution after every update
+        spectra: an iterable of (name, omegas, rp, cp) or (name, error), eg. from watch_directory or tail_file,
+                 or a function that takes the stop event and returns one
+        queue_size: maximum number of spectra read ahead of the fits
+        local_maxiter: budget of each local stage of every refit
+        stop: the threading.Event the source was created with (default a new one), set when the stream ends or is closed
+        fit_options: passed to fit_model (eg. SLSQP=False, constraints='fsum')
+    yields:
+        a dict for every spectrum with the keys 'name', 'params', 'RMS_error', 'fit_report', 'latency' (seconds
+        from the spectrum being read to its fit finishing), 'fit_time' and 'backlog' (spectra waiting in the queue),
+        or for a failed spectrum the keys 'name', 'error', 'latency' and 'backlog'
+    """
+    if (stop is None):
+        stop = threading.Event()
+    if callable(spectra):
+        spectra = spectra(stop)
+    spectra_queue = queue.Queue(queue_size)
+    closed = threading.Event()
+
+    def put(item):
+        while not closed.is_set():
+            try:
+                spectra_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            for item in spectra:
+                if not put((item, time.time())):
+                    return
+            put(_END)
+        except Exception as e:
+            put(e)
+
+    reader = threading.Thread(target=read, name="refit_stream reader", daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = spectra_queue.get()
+            if (item is _END):
+                return
+            if isinstance(item, Exception):
+                raise item
+            (spectrum, read_t) = item
+            if (len(spectrum) == 2): #the source could not read it
+                (name, error) = spectrum
+            else:
+                (name, omegas, rp, cp) = spectrum
+                error = None
+                start_t = time.time()
+                previous = model.getparams()
+                try:
+                    model.fit_model(omegas, rp, cp, differential_evolution=False, verbose=False, local_maxiter=local_maxiter, **fit_options)
+                except Exception as e:
+                    model.setparams(previous)
+                    error = e
+                end_t = time.time()
+            if (error is not None):
+                yield {'name': name, 'error': "%s: %s" % (type(error).__name__, error), 'latency': time.time() - read_t,
+                       'backlog': spectra_queue.qsize()}
+                continue
+            yield {'name': name, 'params': list(model.getparams()), 'RMS_error': float(model.RMS_error), 'fit_report': model.fit_report,
+                   'latency': end_t - read_t, 'fit_time': end_t - start_t, 'backlog': spectra_queue.qsize()}
+    finally:
+        closed.set()
+        stop.set() #the source returns at its next poll, ending the reading thread
@@ -0,0 +1,154 @@
+''' surrogate.py : surrogate-assisted global minimization for cost functions that are expensive to evaluate
+
+For models with lineshapes that are slow to evaluate (eg. StrExp, which needs an FFT per call, or several
+BrendelDHO terms) differential evolution spends most of its time in the tens of thousands of cost
+evaluations it needs. surrogate_minimize instead fits a Gaussian process to the costs evaluated so far and
+only evaluates the true cost where the expected improvement over the best point is largest, typically
+reaching the basin of the global minimum in a few hundred evaluations. The local optimizers of fit_model
+then refine the result.
+'''
+from numpy import *
+from scipy import linalg, optimize
+from scipy.special import erf
+from multiprocessing import Pool
+
+
+class GaussianProcess:
+    """Gaussian process regression with a squared exponential kernel of one length scale, for points in
+    the unit cube. The length scale is chosen by maximizing the marginal likelihood over a grid of values.
+
+    args:
+        X: (n x d) array of points
+        y: the n values at the points
+        nugget: relative noise variance added to the diagonal, which keeps the kernel matrix well conditioned
+    """
+    length_scales = logspace(-1.5, 0.5, 9)
+
+    def __init__(self, X, y, nugget=1e-8, length_scale=None):
+        self.X = array(X, dtype=float)
+        y = array(y, dtype=float)
+        self.ymean = mean(y)
+        self.ystd = std(y) if (std(y) > 0) else 1.0
+        self.y = (y - self.ymean)/self.ystd
+        self.nugget = nugget
+        if (length_scale is None):
+            scores = [self._loglikelihood(l) for l in self.length_scales]
+            length_scale = self.length_scales[argmax(scores)]
+        self._factor(length_scale)
+
+    def _kernel(self, A, B, length_scale):
+        d2 = (A**2).sum(axis=1)[:,None] + (B**2).sum(axis=1)[None,:] - 2*dot(A, B.T)
+        return exp(-0.5*maximum(d2, 0)/length_scale**2)
+
+    def _factor(self, length_scale):
+        self.length_scale = length_scale
+        K = self._kernel(self.X, self.X, length_scale) + self.nugget*eye(len(self.X))
+        self.cho = linalg.cho_factor(K, lower=True)
+        self.alpha = linalg.cho_solve(self.cho, self.y)
+        self.variance = dot(self.y, self.alpha)/len(self.y) #signal variance, profiled out of the likelihood
+
+    def _loglikelihood(self, length_scale):
+        try:
+            self._factor(length_scale)
+        except linalg.LinAlgError:
+            return -inf
+        n = len(self.y)
+        return -0.5*n*log(maximum(self.variance, 1e-300)) - log(diag(self.cho[0])).sum()
+
+    def predict(self, Xs):
+        """mean and standard deviation of the prediction at the points Xs"""
+        Ks = self._kernel(atleast_2d(Xs), self.X, self.length_scale)
+        mu = dot(Ks, self.alpha)
+        v = linalg.solve_triangular(self.cho[0], Ks.T, lower=True)
+        var = self.variance*maximum(1 + self.nugget - (v**2).sum(axis=0), 1e-12)
+        return (self.ymean + self.ystd*mu, self.ystd*sqrt(var))
+
+
+def expected_improvement(mu, sigma, best):
+    '''expected improvement over best of a normal prediction with mean mu and standard deviation sigma'''
+    z = (best - mu)/sigma
+    cdf = 0.5*(1 + erf(z/sqrt(2)))
+    pdf = exp(-0.5*z**2)/sqrt(2*pi)
+    return (best - mu)*cdf + sigma*pdf
+
+
+def surrogate_minimize(costfun, bounds, maxevals=None, ninit=None, batch=4, processes=1, seed=None, ncandidates=2000, callback=None):
+    """minimize costfun within bounds with a Gaussian process surrogate and expected improvement
+
+    The search starts from a Latin hypercube sample of ninit points. Each iteration then fits the surrogate
+    to the logarithm of all costs found so far and proposes a batch of points: each point maximizes the
+    expected improvement among random candidates and perturbations of the best points, and is added to the
+    surrogate with its predicted cost before the next one is chosen ("kriging believer"), so the points of a
+    batch are spread out. The points of a batch are evaluated together, in parallel when processes > 1.
+
+    args:
+        costfun: the function to minimize; it must be picklable when processes > 1 (see spectralmodel.FitCost)
+        bounds: list of (min, max) pairs, which must be finite
+        maxevals: number of cost evaluations (default 20 per parameter, at least 100)
+        ninit: size of the initial sample (default 2*d + 1)
+        batch: number of points evaluated per iteration
+        processes: number of worker processes for the evaluations (None = number of CPUs, 1 = evaluate in this process)
+        seed: integer seed, makes the search reproducible
+        ncandidates: number of candidate points the expected improvement is maximized over
+        callback: function called as callback(x, cost) with the best point after every iteration; if it
+                  returns True the search stops
+    returns:
+        a scipy OptimizeResult with x, fun, nfev, nit and the evaluated points and costs as X and costs
+    """
+    lower = array([b[0] for b in bounds], dtype=float)
+    upper = array([b[1] for b in bounds], dtype=float)
+    if not (all(isfinite(lower)) and all(isfinite(upper))):
+        raise ValueError("surrogate_minimize needs finite bounds")
+    width = upper - lower
+    d = len(bounds)
+    if (maxevals is None):
+        maxevals = int(maximum(20*d, 100))
+    if (ninit is None):
+        ninit = 2*d + 1
+    rng = random.RandomState(seed)
+
+    def evaluate(U):
+        points = [list(lower + u*width) for u in U]
+        costs = map(costfun, points) if (pool is None) else pool.map(costfun, points)
+        return array([float(c) for c in costs])
+
+    #Latin hypercube: one point in each of ninit slices of every coordinate
+    U = (argsort(rng.rand(ninit, d), axis=0) + rng.rand(ninit, d))/ninit
+    pool = Pool(processes) if ((processes is None) or (processes > 1)) else None
+    try:
+        costs = evaluate(U)
+        nit = 0
+        while (len(costs) < maxevals):
+            nit += 1
+            logc = log(maximum(costs - minimum(costs.min(), 0), 1e-300) + 1e-12)
+            gp = GaussianProcess(U, logc)
+            order = argsort(logc)
+            proposals = []
+            fantasyU = U
+            fantasyy = logc
+            for k in range(int(minimum(batch, maxevals - len(costs)))):
+                centers = fantasyU[order[0:5]]
+                scale = gp.length_scale*array([0.3, 0.1, 0.03])
+                local = centers[rng.randint(0, len(centers), ncandidates//2)] + scale[rng.randint(0, 3, ncandidates//2)][:,None]*rng.randn(ncandidates//2, d)
+                candidates = clip(concatenate((rng.rand(ncandidates - ncandidates//2, d), local)), 0, 1)
+                (mu, sigma) = gp.predict(candidates)
+                ei = expected_improvement(mu, sigma, fantasyy.min())
+                u = candidates[argmax(ei)]
+                proposals.append(u)
+                fantasyU = vstack((fantasyU, u))
+                fantasyy = concatenate((fantasyy, gp.predict(u)[0]))
+                gp = GaussianProcess(fantasyU, fantasyy, length_scale=gp.length_scale)
+                order = argsort(fantasyy)
+            U = vstack((U, proposals))
+            costs = concatenate((costs, evaluate(proposals)))
+            best = argmin(costs)
+            if (callback is not None) and (callback(list(lower + U[best]*width), costs[best]) == True):
+                break
+    finally:
+        if (pool is not None):
+            pool.close()
+            pool.join()
+
+    best = argmin(costs)
+    return optimize.OptimizeResult(x=lower + U[best]*width, fun=costs[best], nfev=len(costs), nit=nit,
+                                   X=lower + U*width, costs=costs, success=True)
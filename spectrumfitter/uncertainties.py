@@ -0,0 +1,129 @@
+''' uncertainties.py : bootstrap estimates of the parameter uncertainties of a fitted SpectralModel '''
+from numpy import *
+from copy import deepcopy
+from multiprocessing import Pool
+
+
+class BootstrapResult:
+    """Holds the parameter replicates from bootstrap() and summary statistics derived from them
+
+    attributes:
+        samples: an (n x P) array, one row of refitted parameters per replicate
+        best: the parameters of the fit the replicates were drawn around
+        mean: the mean of the replicates for each parameter
+        cov: the (P x P) covariance matrix of the parameters
+        quantiles: dict mapping each requested quantile to a length-P array
+        names: list of (lineshape name, parameter name) pairs in parameter order
+    """
+    def __init__(self, samples, best, names, quantiles=(0.025, 0.5, 0.975)):
+        self.samples = samples
+        self.best = best
+        self.names = names
+        self.mean = mean(samples, axis=0)
+        self.cov = atleast_2d(cov(samples, rowvar=False))
+        self.std = sqrt(diag(self.cov))
+        self.quantiles = {}
+        for q in quantiles:
+            self.quantiles[q] = quantile(samples, q, axis=0)
+
+    def interval(self, level=0.95):
+        """return (lower, upper) arrays with the central confidence interval at the given level"""
+        lower = quantile(self.samples, (1 - level)/2, axis=0)
+        upper = quantile(self.samples, (1 + level)/2, axis=0)
+        return (lower, upper)
+
+    def print_uncertainties(self, level=0.95):
+        """Write out the best fit value, standard error and confidence interval of every parameter"""
+        (lower, upper) = self.interval(level)
+        print("%20s %12s %10s %10s %10s   (%d%% interval, %d replicates)" % ("name", "parameter", "value", "std", "", 100*level, len(self.samples)))
+        for i in range(len(self.best)):
+            (name, pname) = self.names[i]
+            print(u"%20s %12s %10.4g %10.3g   [%10.4g, %10.4g]" % (name, pname, self.best[i], self.std[i], lower[i], upper[i]))
+
+
+def _resample(dataX, datarp, datacp, fitrp, fitcp, method, rng):
+    '''draw one bootstrap data set.
+
+    'residuals' applies resampled relative residuals of the best fit to the fitted curve, keeping the
+    frequency grid. The residuals are relative, like the fit_model cost, so a residual from a region where
+    eps is large is not added at full size where eps is small. They are centred first: the f-sum penalty
+    keeps the fit slightly off the data, and an offset in the residuals would shift every replicate the
+    same way.
+    'points' resamples (frequency, rp, cp) triples with replacement. The first point is always kept.
+
+    fit_model uses datarp[0] as the static dielectric constant in the f-sum penalty rather than fitting it
+    with the model, so the first point is not a residual of the fit. It is left out of the residuals that
+    are drawn, and with both methods the f-sum target is scattered around its observed value by a drawn
+    residual, so its uncertainty is carried into the replicates the same way.
+    '''
+    N = len(dataX)
+    relrp = (datarp - fitrp)/fitrp
+    relcp = (datacp - fitcp)/fitcp
+    relrp = relrp - relrp[1:].mean()
+    relcp = relcp - relcp[1:].mean()
+    if (method == 'residuals'):
+        idx = rng.randint(1, N, N)
+        X = dataX
+        rp = fitrp*(1 + relrp[idx])
+        cp = fitcp*(1 + relcp[idx])
+    elif (method == 'points'):
+        idx = concatenate(([0], sort(rng.randint(1, N, N - 1))))
+        X = dataX[idx]
+        rp = datarp[idx]
+        cp = datacp[idx]
+    else:
+        raise ValueError("unknown bootstrap method '%s', use 'residuals' or 'points'" % method)
+    rp[0] = datarp[0]*(1 + relrp[rng.randint(1, N)]) #scatter the f-sum target around its observed value
+    return (X, rp, cp)
+
+
+def _refit_replicate(args):
+    '''refit one bootstrap replicate, warm started from the best fit, using the local optimizers only'''
+    (model, best, dataX, datarp, datacp, fitrp, fitcp, method, seed, fit_options) = args
+    rng = random.RandomState(seed)
+    (X, rp, cp) = _resample(dataX, datarp, datacp, fitrp, fitcp, method, rng)
+    model.setparams(best)
+    model.fit_model(X, rp, cp, **dict(fit_options, differential_evolution=False, verbose=False))
+    return model.getparams()
+
+
+def bootstrap(model, dataX, datarp, datacp, n=1000, method='residuals', processes=None, seed=None, quantiles=(0.025, 0.5, 0.975), **fit_options):
+    """estimate parameter uncertainties of a fitted model by bootstrap resampling
+
+    The model should already have been fit to the data (eg. with fit_model); its current parameters are
+    taken as the best fit. Each replicate refits a copy of the model to a resampled data set starting from
+    the best fit with the local (TNC/SLSQP) stages only, and the replicates are spread across a process pool.
+
+    args:
+        model: a fitted SpectralModel object (it is not modified)
+        dataX, datarp, datacp: the data the model was fit to
+        n: number of bootstrap replicates
+        method: 'residuals' to resample the residuals of the best fit, or 'points' to resample frequency points
+        processes: number of worker processes (None = number of CPUs, 1 = run serially)
+        seed: integer seed to make the replicates reproducible
+        quantiles: the quantiles to report for each parameter
+        fit_options: passed to fit_model for every replicate (eg. TNC=False)
+    returns:
+        a BootstrapResult
+    """
+    dataX = asarray(dataX, dtype=float)
+    datarp = asarray(datarp, dtype=float)
+    datacp = asarray(datacp, dtype=float)
+
+    best = list(model.getparams())
+    (fitrp, fitcp) = model(dataX)
+
+    seeds = random.RandomState(seed).randint(0, 2**31 - 1, n)
+    tasks = [(deepcopy(model), best, dataX, datarp, datacp, fitrp, fitcp, method, s, fit_options) for s in seeds]
+
+    if (processes == 1):
+        samples = [_refit_replicate(task) for task in tasks]
+    else:
+        pool = Pool(processes)
+        try:
+            samples = pool.map(_refit_replicate, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    return BootstrapResult(array(samples, dtype=float), array(best, dtype=float), model.getparamnames(), quantiles)
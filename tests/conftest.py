@@ -0,0 +1,49 @@
+''' shared fixtures: a Debye + DHO + constant model and synthetic spectra computed from it '''
+import pytest
+from numpy import logspace, random
+from spectrumfitter.spectralmodel import SpectralModel
+from spectrumfitter.spectrumfitter import Debye, DHO, constant
+
+TRUE_PARAMS = [72, 0.6, 2, 220, 150, 3]
+
+
+def debye_dho_model():
+    '''the model at its starting parameters, which are close to but not at TRUE_PARAMS'''
+    model = SpectralModel([])
+    model.add(Debye([70, 0.5], [(60, 80), (0.3, 0.8)]))
+    model.add(DHO([1, 200, 100], [(0, 5), (100, 300), (10, 400)]))
+    model.add(constant([2], [(1, 5)]))
+    return model
+
+
+def synthetic_spectrum(noise=0.0, seed=0, npoints=100):
+    '''(w, rp, cp) of the model at TRUE_PARAMS, from the static limit to above the DHO, with relative gaussian noise'''
+    w = logspace(-2, 3, npoints)
+    model = debye_dho_model()
+    model.setparams(TRUE_PARAMS)
+    (rp, cp) = model(w)
+    rng = random.RandomState(seed)
+    return (w, rp*(1 + noise*rng.randn(npoints)), cp*(1 + noise*rng.randn(npoints)))
+
+
+@pytest.fixture
+def make_model():
+    '''a function that returns a new copy of the model'''
+    return debye_dho_model
+
+
+@pytest.fixture
+def spectrum():
+    '''noise free (w, rp, cp) of the model at TRUE_PARAMS'''
+    return synthetic_spectrum()
+
+
+@pytest.fixture
+def noisy_spectrum():
+    '''(w, rp, cp) of the model at TRUE_PARAMS with 1% relative noise'''
+    return synthetic_spectrum(noise=0.01, seed=1)
+
+
+@pytest.fixture
+def true_params():
+    return list(TRUE_PARAMS)
@@ -0,0 +1,35 @@
+''' tests of checkpointed fits: an interrupted and resumed fit ends where an uninterrupted one does '''
+import pytest
+from numpy import allclose
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_resume_equals_uninterrupted(tmp_path, make_model, spectrum):
+    (w, rp, cp) = spectrum
+    uninterrupted = make_model()
+    uninterrupted.fit_model(w, rp, cp, seed=3, TNC=False, SLSQP=False, verbose=False)
+
+    checkpoint = str(tmp_path/"fit.pkl")
+    generations = [0]
+    def interrupt(stage, params, cost):
+        generations[0] += 1
+        if (generations[0] == 15):
+            raise Interrupted()
+    with pytest.raises(Interrupted):
+        make_model().fit_model(w, rp, cp, seed=3, TNC=False, SLSQP=False, verbose=False, checkpoint=checkpoint,
+                               checkpoint_every=4, callback=interrupt)
+
+    resumed = make_model()
+    resumed.fit_model(w, rp, cp, seed=3, TNC=False, SLSQP=False, verbose=False, checkpoint=checkpoint, resume=True)
+    assert allclose(resumed.getparams(), uninterrupted.getparams(), rtol=1e-10)
+
+
+def test_checkpoint_of_another_fit_is_refused(tmp_path, make_model, spectrum):
+    (w, rp, cp) = spectrum
+    checkpoint = str(tmp_path/"fit.pkl")
+    make_model().fit_model(w, rp, cp, differential_evolution=False, verbose=False, checkpoint=checkpoint)
+    with pytest.raises(ValueError):
+        make_model().fit_model(w, 1.1*rp, cp, differential_evolution=False, verbose=False, checkpoint=checkpoint, resume=True)
@@ -0,0 +1,57 @@
+''' tests of the spectrumfitter command '''
+import json
+import pytest
+from numpy import allclose, column_stack, savetxt, sqrt
+from spectrumfitter.cli import main
+from spectrumfitter.modelspec import model_to_spec
+from spectrumfitter.spectrumfitter import load_spectrum
+
+
+@pytest.fixture
+def spec_file(tmp_path, make_model):
+    fname = str(tmp_path/"model.json")
+    with open(fname, "w") as f:
+        json.dump(dict(model_to_spec(make_model()), fit={"SLSQP": False}), f)
+    return fname
+
+
+def test_ri_files_are_converted_to_eps(tmp_path, spectrum):
+    (w, rp, cp) = spectrum
+    n = sqrt((sqrt(rp**2 + cp**2) + rp)/2) #n + ik = sqrt(eps)
+    k = cp/(2*n)
+    fname = str(tmp_path/"spectrum.RI")
+    savetxt(fname, column_stack((w, n, k)))
+    (omegas, RIrp, RIcp) = load_spectrum(fname)
+    assert allclose(RIrp, rp) and allclose(RIcp, cp)
+
+
+def test_fits_every_file_and_reports_bad_ones(tmp_path, capsys, spec_file, spectrum):
+    (w, rp, cp) = spectrum
+    good = str(tmp_path/"good.dat")
+    savetxt(good, column_stack((w, rp, cp)))
+    bad = str(tmp_path/"bad.dat")
+    with open(bad, "w") as f:
+        f.write("not a spectrum\n")
+    output = str(tmp_path/"fits.jsonl")
+    status = main([spec_file, good, bad, "--no-de", "--output", output, "--report-dir", str(tmp_path/"reports")])
+    assert status == 1
+    results = dict([(r["file"], r) for r in map(json.loads, open(output))])
+    assert (results[good]["RMS_error"] < 0.05) and ("error" in results[bad])
+    assert "1 of 2 fits failed" in capsys.readouterr().err
+    assert (tmp_path/"reports"/"good.dat.txt").exists()
+
+
+@pytest.mark.parametrize("change", [{"lineshapes": [{"type": "NoSuchLineshape", "params": [1], "bounds": [[0, 2]]}]},
+                                    {"data": {"maxfreq": 100}},
+                                    {"fit": {"differential_evolutoin": False}}])
+def test_invalid_spec_is_refused_before_fitting(tmp_path, capsys, spec_file, spectrum, change):
+    spec = json.load(open(spec_file))
+    spec.update(change)
+    with open(spec_file, "w") as f:
+        json.dump(spec, f)
+    (w, rp, cp) = spectrum
+    data = str(tmp_path/"good.dat")
+    savetxt(data, column_stack((w, rp, cp)))
+    assert main([spec_file, data, data, "--no-de"]) == 2
+    captured = capsys.readouterr()
+    assert (captured.out == "") and (captured.err.count("invalid model specification") == 1)
@@ -0,0 +1,59 @@
+''' tests of the f-sum and gLST constraints: analytic Jacobians and the repair onto the constraint surface '''
+import pytest
+from numpy import allclose, array, abs
+from scipy.optimize import approx_fprime, OptimizeResult
+from spectrumfitter.constraints import FSumConstraint, GLSTConstraint, repair, checked_result
+
+
+@pytest.fixture
+def models(make_model, true_params):
+    '''a longitudinal and a transverse model, and their joint parameter vector and bounds'''
+    (modelL, modelT) = (make_model(), make_model())
+    modelT.setparams(true_params)
+    params = array(modelL.getparams() + modelT.getparams(), dtype=float)
+    return (modelL, modelT, params, modelL.getbounds() + modelT.getbounds())
+
+
+@pytest.mark.parametrize("type", ['eq', 'ineq'])
+def test_fsum_jacobian(models, type):
+    (modelL, modelT, params, bounds) = models
+    constraint = FSumConstraint(modelT, 70.0, offset=len(modelL.getparams()), type=type)
+    assert allclose(constraint.jac(params), approx_fprime(params, constraint.fun, 1e-6), atol=1e-5)
+
+
+def test_glst_jacobian(models):
+    (modelL, modelT, params, bounds) = models
+    constraint = GLSTConstraint(modelL, modelT, 20.0, offsetT=len(modelL.getparams()))
+    assert allclose(constraint.jac(params), approx_fprime(params, constraint.fun, 1e-7), rtol=1e-4, atol=1e-6)
+
+
+def test_repair_lands_on_the_constraints(models):
+    (modelL, modelT, params, bounds) = models
+    offset = len(modelL.getparams())
+    constraints = [FSumConstraint(modelT, 70.0, offset=offset), GLSTConstraint(modelL, modelT, 1.5, offsetT=offset)]
+    assert all([c.violation(params) > 1e-3 for c in constraints])
+    repaired = repair(constraints, params, bounds)
+    assert all([c.violation(repaired) < 1e-10 for c in constraints])
+    assert all([(lo <= x <= hi) for (x, (lo, hi)) in zip(repaired, bounds)])
+
+
+def test_fsum_inequality_repair_only_moves_infeasible_points(models):
+    (modelL, modelT, params, bounds) = models
+    offset = len(modelL.getparams())
+    feasible = FSumConstraint(modelT, 100.0, offset=offset, type='ineq')
+    assert allclose(feasible.repair(params, bounds), params)
+    infeasible = FSumConstraint(modelT, 70.0, offset=offset, type='ineq')
+    assert abs(infeasible.repair(params, bounds)[infeasible.indices].sum() - 70.0) < 1e-10
+
+
+def test_checked_result_falls_back_to_a_feasible_point(models):
+    (modelL, modelT, params, bounds) = models
+    offset = len(modelL.getparams())
+    constraints = [FSumConstraint(modelT, 70.0, offset=offset)]
+    cost = lambda x: ((array(x) - params)**2).sum()
+    accepted = OptimizeResult(x=repair(constraints, params, bounds), success=True, message="")
+    (x, message) = checked_result(accepted, params, constraints, bounds, cost)
+    assert (message is None) and allclose(x, accepted.x)
+    failed = OptimizeResult(x=params, success=False, message="Positive directional derivative for linesearch")
+    (x, message) = checked_result(failed, params, constraints, bounds, cost)
+    assert (constraints[0].violation(x) < 1e-10) and message.startswith("Positive directional derivative")
@@ -0,0 +1,56 @@
+''' tests of the fit cache: key stability, least-recently-used eviction and hits in fit_model '''
+import os
+from numpy import allclose
+from spectrumfitter.fitcache import FitCache, fit_key, model_signature
+from spectrumfitter.spectrumfitter import Debye
+
+
+def test_model_signature_depends_on_structure_only(make_model, true_params):
+    (a, b) = (make_model(), make_model())
+    b.setparams(true_params)
+    assert model_signature(a) == model_signature(b)
+    b.add(Debye([1, 10], [(0, 5), (1, 50)]))
+    assert model_signature(a) != model_signature(b)
+
+
+def test_fit_key_is_stable_and_covers_every_input(make_model, spectrum, true_params):
+    (w, rp, cp) = spectrum
+    options = {'differential_evolution': False, 'TNC': True}
+    key = fit_key(make_model(), w, rp, cp, options)
+    assert key == fit_key(make_model(), w.copy(), list(rp), cp, dict(options))
+
+    other_params = make_model()
+    other_params.setparams(true_params)
+    other_bounds = make_model()
+    other_bounds.lineshapes[0].bounds = [(0, 100), (0.1, 1)]
+    assert key != fit_key(other_params, w, rp, cp, options)
+    assert key != fit_key(other_bounds, w, rp, cp, options)
+    assert key != fit_key(make_model(), w, 1.01*rp, cp, options)
+    assert key != fit_key(make_model(), w, rp, cp, dict(options, TNC=False))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = FitCache(str(tmp_path), max_entries=2)
+    for (t, key) in enumerate(['a', 'b']):
+        cache.put(key, {'value': key})
+        os.utime(cache._path(key), (1000 + t, 1000 + t))
+    assert cache.get('a') == {'value': 'a'} #'a' is now the most recently used
+    cache.put('c', {'value': 'c'})
+    assert (cache.get('b') is None) and (cache.get('a') is not None) and (cache.get('c') is not None)
+    assert sorted(os.listdir(str(tmp_path))) == ['a.pkl', 'c.pkl'] #no temporary files are left behind
+
+
+def test_fit_model_hits_and_misses(tmp_path, make_model, spectrum):
+    (w, rp, cp) = spectrum
+    first = make_model()
+    first.fit_model(w, rp, cp, differential_evolution=False, verbose=False, cache=str(tmp_path))
+    assert first.fit_report['cached'] == False
+
+    again = make_model()
+    again.fit_model(w, rp, cp, differential_evolution=False, verbose=False, cache=str(tmp_path))
+    assert again.fit_report['cached'] == True
+    assert allclose(again.getparams(), first.getparams()) and (again.RMS_error == first.RMS_error)
+
+    other = make_model()
+    other.fit_model(w, rp, cp, differential_evolution=False, SLSQP=False, verbose=False, cache=str(tmp_path))
+    assert other.fit_report['cached'] == False
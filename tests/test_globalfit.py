@@ -0,0 +1,73 @@
+''' tests of joint fits: parameter ties, shared lineshapes and the per-grid evaluation cache '''
+import pytest
+from numpy import allclose, logspace
+from spectrumfitter.globalfit import GlobalFit
+from spectrumfitter.spectralmodel import SpectralModel
+from spectrumfitter.spectrumfitter import DHO
+
+
+class CountingDHO(DHO):
+    '''a DHO that counts how often it is evaluated'''
+    calls = 0
+
+    def __call__(self, w):
+        CountingDHO.calls += 1
+        return DHO.__call__(self, w)
+
+
+def test_complex_observable_needs_imaginary_data(make_model, spectrum):
+    (w, rp, cp) = spectrum
+    gf = GlobalFit()
+    for kind in ('eps', 'longeps'):
+        with pytest.raises(ValueError):
+            gf.add_observable(make_model(), w, rp, kind=kind)
+    gf.add_observable(make_model(), w, cp, kind='raman')
+    assert len(gf.observables) == 1
+
+
+def test_tied_parameter_follows_its_source(make_model, spectrum):
+    (w, rp, cp) = spectrum
+    (modelA, modelB) = (make_model(), make_model())
+    gf = GlobalFit()
+    gf.add_observable(modelA, w, rp, cp)
+    gf.add_observable(modelB, w, rp, cp)
+    gf.tie(modelB.lineshapes[1], 'w', modelA.lineshapes[1])
+    nfree = len(modelA.getparams()) + len(modelB.getparams()) - 1
+    assert len(gf.getparams()) == nfree
+    assert len(gf.getbounds()) == nfree
+
+    params = gf.getparams()
+    params[modelA.getparamnames().index(('DHO', 'w'))] = 250.0
+    gf.setparams(params)
+    assert modelB.lineshapes[1].p[1] == 250.0
+
+
+def test_circular_ties_are_refused(make_model, spectrum):
+    (w, rp, cp) = spectrum
+    (modelA, modelB) = (make_model(), make_model())
+    gf = GlobalFit()
+    gf.add_observable(modelA, w, rp, cp)
+    gf.add_observable(modelB, w, rp, cp)
+    gf.tie(modelB.lineshapes[1], 'w', modelA.lineshapes[1])
+    gf.tie(modelA.lineshapes[1], 'w', modelB.lineshapes[1])
+    with pytest.raises(ValueError):
+        gf.getparams()
+
+
+def test_shared_lineshape_is_evaluated_once_per_grid(make_model, spectrum):
+    (w, rp, cp) = spectrum
+    shared = CountingDHO([1, 200, 100], [(0, 5), (100, 300), (10, 400)])
+    (modelT, modelL) = (SpectralModel([]), SpectralModel([]))
+    for model in (modelT, modelL):
+        model.add(make_model().lineshapes[0])
+        model.add(shared)
+    gf = GlobalFit()
+    gf.add_observable(modelT, w, rp, cp)
+    gf.add_observable(modelL, w.copy(), rp, cp, kind='longeps')
+    gf.add_observable(modelT, logspace(0, 3, 20), rp[0:20], cp[0:20])
+    assert len(gf.grids) == 2
+
+    CountingDHO.calls = 0
+    responses = gf._evaluate()
+    assert CountingDHO.calls == 2
+    assert allclose(responses[0], modelT(w)) and allclose(responses[1], modelL(w))
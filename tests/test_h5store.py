@@ -0,0 +1,62 @@
+''' tests of the HDF5 store of spectra and fit results '''
+import pytest
+from numpy import allclose, array_equal, logspace
+pytest.importorskip("h5py")
+from spectrumfitter.h5store import SpectrumStore
+
+
+@pytest.fixture
+def store(tmp_path, spectrum):
+    (w, rp, cp) = spectrum
+    fname = str(tmp_path/"spectra.h5")
+    with SpectrumStore(fname) as store:
+        store.add_spectrum('a', w, rp, cp)
+        store.add_spectrum('b', w, 1.01*rp, 1.01*cp)
+        store.add_spectrum('c', w[0:50], rp[0:50], cp[0:50])
+    return fname
+
+
+def test_spectra_round_trip(store, spectrum):
+    (w, rp, cp) = spectrum
+    with SpectrumStore(store, 'r') as s:
+        assert s.names() == ['a', 'b', 'c'] and len(s) == 3 and ('b' in s)
+        assert len(s.grids()) == 2
+        (omegas, srp, scp) = s['b']
+        assert array_equal(omegas, w) and allclose(srp, 1.01*rp) and allclose(scp, 1.01*cp)
+        assert [name for (name, omegas, srp, scp) in s.iter_spectra()] == ['a', 'b', 'c']
+
+
+def test_overwrite(store, spectrum):
+    (w, rp, cp) = spectrum
+    with SpectrumStore(store) as s:
+        with pytest.raises(ValueError):
+            s.add_spectrum('a', w, rp, cp)
+        s.add_spectrum('a', w, 2*rp, cp, overwrite=True) #same grid, written in place
+        s.add_spectrum('c', w, 3*rp, cp, overwrite=True) #moved to another grid
+    with SpectrumStore(store, 'r') as s:
+        assert s.names() == ['a', 'b', 'c']
+        assert allclose(s['a'][1], 2*rp) and allclose(s['c'][1], 3*rp) and (len(s['c'][0]) == len(w))
+
+
+def test_fit_all_keeps_setups_apart(store, make_model, capsys):
+    with SpectrumStore(store) as s:
+        model = make_model()
+        s.fit_all(model, names=['a', 'b'], differential_evolution=False)
+        s.fit_all(model, differential_evolution=False) #only 'c' is left to do
+        assert len(capsys.readouterr().out.strip().split("\n")) == 3
+        (names, params, RMS_errors) = s.results(model, {'differential_evolution': False})
+        assert (names == ['a', 'b', 'c']) and (params.shape == (3, 6)) and (RMS_errors[0] < 0.01)
+        assert model.getparams() == make_model().getparams() #the model itself is not modified
+
+        s.fit_all(model, names=['a'], differential_evolution=False, SLSQP=False)
+        narrow = make_model()
+        narrow.lineshapes[0].bounds = [(60, 71), (0.3, 0.8)]
+        s.fit_all(narrow, names=['a'], differential_evolution=False)
+        assert len(s.signatures()) == 3
+
+        fitted = make_model()
+        assert allclose(s.result('a', fitted, {'differential_evolution': False}), params[0])
+        assert fitted.RMS_error == RMS_errors[0]
+        assert s.result('a', narrow, {'differential_evolution': False})[0] <= 71
+        with pytest.raises(KeyError):
+            s.result('b', narrow, {'differential_evolution': False})
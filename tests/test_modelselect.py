@@ -0,0 +1,25 @@
+''' tests of model selection on a synthetic Debye + DHO spectrum '''
+import pytest
+from spectrumfitter.modelselect import select_model, information_criteria
+from spectrumfitter.spectrumfitter import Debye, DHO, constant
+
+
+def candidates():
+    return [Debye([10, 0.3], [(0, 100), (0.01, 10)], "Debye 1"), Debye([1, 3], [(0, 100), (0.01, 10)], "Debye 2"),
+            DHO([0.5, 150, 40], [(0, 5), (100, 300), (10, 400)], "DHO 1"), DHO([0.5, 600, 40], [(0, 5), (300, 800), (10, 400)], "DHO 2")]
+
+
+def test_information_criteria_penalize_parameters():
+    (aic, bic) = information_criteria(0.01, 200, 5)
+    (aic2, bic2) = information_criteria(0.01, 200, 6)
+    assert (aic2 - aic == 2) and (bic2 - bic > 2)
+
+
+@pytest.mark.parametrize("criterion", ['aic', 'bic'])
+def test_selects_the_generating_lineshapes(noisy_spectrum, criterion):
+    (w, rp, cp) = noisy_spectrum
+    result = select_model(candidates(), w, rp, cp, base=[constant([2], [(1, 5)], "eps inf")], criterion=criterion,
+                          top=1, processes=1, seed=1, verbose=False)
+    assert sorted([l.type for l in result.best.lineshapes]) == ['Constant', 'DHO', 'Debye']
+    assert result.candidates[0]['stage'] == 'global'
+    assert 'pruned' in [c['stage'] for c in result.candidates]
@@ -0,0 +1,72 @@
+''' tests of FitScheduler priorities and cancellation, run in-process with a ThreadPoolExecutor '''
+import asyncio
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from spectrumfitter.scheduler import FitScheduler, FitCancelled
+
+
+async def started(scheduler):
+    '''wait until the scheduler is running a fit'''
+    while (len(scheduler._running) == 0):
+        await asyncio.sleep(0.001)
+
+
+def test_lower_priority_number_runs_first(make_model, spectrum):
+    (w, rp, cp) = spectrum
+    finished = []
+
+    async def fit(scheduler, name, **options):
+        await scheduler.submit_fit(make_model(), w, rp, cp, **options)
+        finished.append(name)
+
+    async def main():
+        async with FitScheduler(ThreadPoolExecutor(1), max_workers=1, poll_interval=0.01) as scheduler:
+            first = asyncio.ensure_future(fit(scheduler, 'first', seed=1, TNC=False, SLSQP=False))
+            await started(scheduler)
+            late = asyncio.ensure_future(fit(scheduler, 'global', seed=1, TNC=False, SLSQP=False))
+            await asyncio.sleep(0)
+            urgent = asyncio.ensure_future(fit(scheduler, 'local', differential_evolution=False))
+            await asyncio.gather(first, late, urgent)
+
+    asyncio.run(main())
+    assert finished == ['first', 'local', 'global']
+
+
+def test_cancel_running_and_waiting_fits(make_model, spectrum):
+    (w, rp, cp) = spectrum
+    stages = []
+
+    async def main():
+        async with FitScheduler(ThreadPoolExecutor(1), max_workers=1, poll_interval=0.01) as scheduler:
+            running = asyncio.ensure_future(scheduler.submit_fit(make_model(), w, rp, cp, seed=1, progress=lambda stage, cost: stages.append(stage)))
+            while (len(stages) == 0):
+                await asyncio.sleep(0.001)
+            waiting = asyncio.ensure_future(scheduler.submit_fit(make_model(), w, rp, cp, seed=2))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            running.cancel()
+            results = await asyncio.gather(running, waiting, return_exceptions=True)
+            assert [type(r) for r in results] == [asyncio.CancelledError, asyncio.CancelledError]
+            #the worker is free again once the running fit has stopped at its next iteration
+            model = await asyncio.wait_for(scheduler.submit_fit(make_model(), w, rp, cp, differential_evolution=False), 30)
+            assert 'TNC' in model.fit_report['nit']
+
+    asyncio.run(main())
+    assert stages[0] == 'differential_evolution'
+
+
+def test_close_cancels_outstanding_fits(make_model, spectrum):
+    (w, rp, cp) = spectrum
+
+    async def main():
+        scheduler = FitScheduler(ThreadPoolExecutor(1), max_workers=1, poll_interval=0.01)
+        running = asyncio.ensure_future(scheduler.submit_fit(make_model(), w, rp, cp, seed=1))
+        await started(scheduler)
+        waiting = asyncio.ensure_future(scheduler.submit_fit(make_model(), w, rp, cp, seed=2))
+        await asyncio.sleep(0)
+        await scheduler.close()
+        for task in (running, waiting):
+            with pytest.raises(FitCancelled):
+                await task
+
+    asyncio.run(main())
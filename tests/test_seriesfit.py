@@ -0,0 +1,65 @@
+''' tests of series fits: the Jacobian sparsity pattern and recovery of known temperature trends '''
+import pytest
+from numpy import abs, allclose, array, diff, exp, logspace, zeros
+from spectrumfitter.seriesfit import SeriesFit
+
+TEMPERATURES = [260, 280, 300, 320, 340]
+
+
+def trend_params(T):
+    '''Debye strength falling linearly and Debye frequency following an Arrhenius law, the rest constant'''
+    return [72 - 0.1*(T - 300), 0.6*exp(1 - 300.0/T), 2, 220, 150, 3]
+
+
+@pytest.fixture
+def series(make_model):
+    w = logspace(-2, 3, 60)
+    spectra = []
+    for T in TEMPERATURES:
+        model = make_model()
+        model.setparams(trend_params(T))
+        spectra.append((w,) + model(w))
+    model = make_model()
+    fit = SeriesFit(model, TEMPERATURES, spectra)
+    (debye, dho, eps_inf) = model.lineshapes
+    fit.set_dependence(debye, 'f', ('poly', 1))
+    fit.set_dependence(debye, 'wD', 'arrhenius')
+    fit.set_dependence(eps_inf, 0, 'constant')
+    for pname in dho.pnames:
+        fit.set_dependence(dho, pname, 'free', smoothness=1.0)
+    return fit
+
+
+def test_jac_sparsity_covers_the_jacobian(series):
+    series.fit(verbose=False, max_nfev=1)
+    S = series.jac_sparsity().toarray()
+    x = series.x
+    r0 = series.residuals(x)
+    assert S.shape == (len(r0), len(x))
+    J = zeros(S.shape)
+    for j in range(len(x)):
+        step = 1e-6*(1 + abs(x[j]))
+        dx = x.copy()
+        dx[j] += step
+        J[:,j] = (series.residuals(dx) - r0)/step
+    assert (S[abs(J) > 1e-9] == 1).all() #every nonzero derivative is in the pattern
+    npoints = 2*60
+    for k in range(len(TEMPERATURES)): #a spectrum depends on the shared coefficients and its own free parameters only
+        rows = S[k*npoints:(k + 1)*npoints]
+        assert rows.sum(axis=1).tolist() == [2 + 2 + 1 + 3]*npoints
+
+
+def test_known_trends_are_recovered(series):
+    series.fit(verbose=False)
+    truth = array([trend_params(T) for T in TEMPERATURES])
+    assert allclose(series.table, truth, rtol=1e-3)
+    assert max(series.RMS_errors) < 1e-4
+
+
+def test_trend_against_a_bound_stays_within_it(series):
+    series.model.lineshapes[0].bounds[0] = (60, 74) #the true strength at the lowest temperature is 76
+    series.fit(verbose=False)
+    f = series.table[:,0]
+    assert (f <= 74 + 1e-9).all() and (f >= 60).all()
+    assert abs(f[0] - 74) < 1e-3 #the trend runs up against the bound instead of stalling short of it
+    assert allclose(diff(f, 2), 0, atol=1e-8) #and is still a straight line, not one clipped at the bound
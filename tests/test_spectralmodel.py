@@ -0,0 +1,46 @@
+''' tests of the grouped evaluation of a SpectralModel against the sum of its lineshapes '''
+from numpy import allclose, linspace, zeros
+from spectrumfitter.spectralmodel import SpectralModel
+from spectrumfitter.spectrumfitter import Debye, DHO, constant
+
+
+def lineshape_sum(model, w):
+    '''the model evaluated one lineshape at a time'''
+    rp = zeros(len(w))
+    cp = zeros(len(w))
+    for l in model.lineshapes:
+        (rpPart, cpPart) = l(w)
+        rp = rp + rpPart
+        cp = cp + cpPart
+    return (rp, cp)
+
+
+def test_grouped_call_matches_lineshape_sum():
+    w = linspace(1, 1000, 200)
+    model = SpectralModel([])
+    model.add(Debye([70, 0.5], [(60, 80), (0.3, 0.8)]))
+    model.add(Debye([3, 10], [(0, 10), (1, 50)]))
+    model.add(DHO([1, 200, 100], [(0, 5), (100, 300), (10, 400)]))
+    model.add(DHO([0.5, 600, 50], [(0, 5), (400, 800), (10, 400)]))
+    model.add(constant([2], [(1, 5)]))
+    (rp, cp) = model(w)
+    (rpSum, cpSum) = lineshape_sum(model, w)
+    assert allclose(rp, rpSum) and allclose(cp, cpSum)
+
+    model.setparams([72, 0.6, 2, 12, 2, 220, 150, 1, 650, 40, 3])
+    (rp, cp) = model(w)
+    (rpSum, cpSum) = lineshape_sum(model, w)
+    assert allclose(rp, rpSum) and allclose(cp, cpSum)
+
+
+def test_grouped_call_after_replacing_a_lineshape():
+    w = linspace(1, 500, 50)
+    for trial in range(20): #a replaced lineshape can reuse the id of the deleted one
+        model = SpectralModel([])
+        model.add(Debye([3.0, 0.5], [(0, 20), (0.01, 10)]))
+        model(w)
+        del model.lineshapes[0]
+        model.add(DHO([1.0, 200, 50], [(0, 10), (50, 400), (5, 200)]))
+        (rp, cp) = model(w)
+        (rpSum, cpSum) = model.lineshapes[0](w)
+        assert allclose(rp, rpSum) and allclose(cp, cpSum)
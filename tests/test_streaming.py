@@ -0,0 +1,77 @@
+''' tests of following a growing file and refitting every spectrum in it '''
+import os
+import threading
+import time
+import pytest
+from numpy import savetxt, column_stack
+from spectrumfitter.streaming import tail_file, watch_directory, refit_stream
+
+
+def write_blocks(fname, w, rp, cp, nblocks, bad_block=None):
+    with open(fname, 'w') as f:
+        f.write("# freq rp cp\n")
+        for k in range(nblocks):
+            for i in range(len(w)):
+                f.write("garbage\n" if ((k == bad_block) and (i == 5)) else "%.10g %.10g %.10g\n" % (w[i], rp[i], cp[i]))
+            if (k < nblocks - 1): #the last block is not closed by a blank line
+                f.write("\n")
+
+
+def test_tail_file_yields_every_block(tmp_path, spectrum):
+    (w, rp, cp) = spectrum
+    fname = str(tmp_path/"stream.dat")
+    write_blocks(fname, w, rp, cp, 3)
+    spectra = list(tail_file(fname, poll_interval=0.01, timeout=0.05))
+    assert [s[0] for s in spectra] == ["%s:%d" % (fname, k) for k in range(3)]
+    assert all([len(s[1]) == len(w) for s in spectra])
+
+
+def test_refit_stream_continues_after_bad_block(tmp_path, make_model, spectrum):
+    (w, rp, cp) = spectrum
+    fname = str(tmp_path/"stream.dat")
+    write_blocks(fname, w, rp, cp, 3, bad_block=1)
+    model = make_model()
+    updates = list(refit_stream(model, tail_file(fname, poll_interval=0.01, timeout=0.05), queue_size=1))
+    assert [u['name'] for u in updates] == ["%s:%d" % (fname, k) for k in range(3)]
+    assert ('error' not in updates[0]) and ('error' in updates[1]) and ('error' not in updates[2])
+    assert updates[2]['RMS_error'] < 0.1
+
+
+def test_refit_stream_continues_after_failed_fit(make_model, spectrum):
+    (w, rp, cp) = spectrum
+    model = make_model()
+    updates = list(refit_stream(model, [('short', w, rp[0:10], cp), ('ok', w, rp, cp)]))
+    assert ('error' in updates[0]) and ('error' not in updates[1])
+
+
+def test_watch_directory_skips_unreadable_files(tmp_path, spectrum):
+    (w, rp, cp) = spectrum
+    savetxt(str(tmp_path/"a.dat"), column_stack((w, rp, cp)))
+    with open(str(tmp_path/"b.dat"), 'w') as f:
+        f.write("not a spectrum\n")
+    savetxt(str(tmp_path/"c.dat"), column_stack((w, rp, cp)))
+    spectra = list(watch_directory(str(tmp_path), poll_interval=0.01, timeout=0.05))
+    assert [os.path.basename(s[0]) for s in spectra] == ['a.dat', 'b.dat', 'c.dat']
+    assert [len(s) for s in spectra] == [4, 2, 4]
+
+
+def reader_alive():
+    return any([t.name == "refit_stream reader" for t in threading.enumerate()])
+
+
+@pytest.mark.parametrize("own_event", [False, True])
+def test_closing_the_stream_stops_the_source(tmp_path, make_model, spectrum, own_event):
+    (w, rp, cp) = spectrum
+    savetxt(str(tmp_path/"a.dat"), column_stack((w, rp, cp)))
+    if own_event:
+        stop = threading.Event()
+        stream = refit_stream(make_model(), watch_directory(str(tmp_path), poll_interval=0.01, stop=stop), stop=stop)
+    else:
+        stream = refit_stream(make_model(), lambda stop: watch_directory(str(tmp_path), poll_interval=0.01, stop=stop))
+    assert 'error' not in next(stream)
+    stream.close() #watch_directory has no timeout, only the stop event ends it
+    for i in range(100):
+        if not reader_alive():
+            break
+        time.sleep(0.01)
+    assert not reader_alive()
@@ -0,0 +1,51 @@
+''' tests of the Gaussian process surrogate and the surrogate-assisted minimization '''
+from numpy import abs, allclose, array, linspace, random, sin, sqrt
+from spectrumfitter.surrogate import GaussianProcess, expected_improvement, surrogate_minimize
+
+
+def quadratic(x):
+    return (x[0] - 0.3)**2 + 2*(x[1] + 0.2)**2
+
+
+def test_gaussian_process_interpolates_its_points():
+    X = random.RandomState(0).rand(15, 2)
+    y = sin(3*X[:,0]) + X[:,1]**2
+    gp = GaussianProcess(X, y)
+    (mu, sigma) = gp.predict(X)
+    assert allclose(mu, y, atol=1e-3)
+    assert (sigma < 1e-2).all()
+    (mu, far) = gp.predict(array([[3.0, 3.0]]))
+    assert far[0] > 10*sigma.max() #uncertain far from the data
+
+
+def test_expected_improvement():
+    sigma = linspace(0.01, 1, 5)
+    ei = expected_improvement(0.0, sigma, 0.0)
+    assert (ei > 0).all() and (ei[1:] > ei[:-1]).all() #at the best value, more uncertainty is more promising
+    assert allclose(expected_improvement(-1.0, 1e-9, 0.0), 1.0) #a certain improvement is the improvement itself
+    assert expected_improvement(1.0, 1e-9, 0.0) < 1e-12
+
+
+def test_reaches_the_minimum_within_its_budget():
+    result = surrogate_minimize(quadratic, [(-1, 1), (-1, 1)], maxevals=60, seed=1)
+    assert result.nfev <= 60
+    assert result.fun < 1e-3
+    assert sqrt(((result.x - array([0.3, -0.2]))**2).sum()) < 0.05
+    again = surrogate_minimize(quadratic, [(-1, 1), (-1, 1)], maxevals=60, seed=1)
+    assert allclose(again.x, result.x) #reproducible with a seed
+
+
+def test_callback_stops_the_search():
+    result = surrogate_minimize(quadratic, [(-1, 1), (-1, 1)], maxevals=100, seed=1, callback=lambda x, cost: True)
+    assert (result.nit == 1) and (result.nfev == 5 + 4)
+
+
+def test_fit_model_accepts_seed_and_callback_in_surrogate_options(make_model, spectrum):
+    (w, rp, cp) = spectrum
+    (stages, calls) = ([], [])
+    model = make_model()
+    model.fit_model(w, rp, cp, surrogate=True, TNC=False, SLSQP=False, verbose=False, seed=1,
+                    callback=lambda stage, params, cost: stages.append(stage),
+                    surrogate_options={'maxevals': 30, 'seed': 2, 'callback': lambda x, cost: calls.append(cost)})
+    assert (len(calls) > 0) and (len(stages) == len(calls)) and (set(stages) == set(['surrogate']))
+    assert model.fit_report['nfev']['surrogate'] == 30
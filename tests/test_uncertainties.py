@@ -0,0 +1,36 @@
+''' tests of the bootstrap uncertainties on a synthetic spectrum with known parameters '''
+import pytest
+from numpy import all, array
+from spectrumfitter.uncertainties import bootstrap
+
+
+@pytest.fixture
+def fitted(make_model, noisy_spectrum, true_params):
+    (w, rp, cp) = noisy_spectrum
+    model = make_model()
+    model.setparams(true_params)
+    model.fit_model(w, rp, cp, differential_evolution=False, verbose=False)
+    return model
+
+
+@pytest.mark.parametrize("method", ['residuals', 'points'])
+def test_interval_covers_estimate_and_truth(fitted, noisy_spectrum, true_params, method):
+    (w, rp, cp) = noisy_spectrum
+    result = bootstrap(fitted, w, rp, cp, n=60, method=method, processes=1, seed=1)
+    (lower, upper) = result.interval(0.95)
+    assert all((lower <= result.best) & (result.best <= upper))
+    assert all((lower <= array(true_params)) & (array(true_params) <= upper))
+
+
+def test_methods_agree_on_fsum_target(fitted, noisy_spectrum):
+    (w, rp, cp) = noisy_spectrum
+    residuals = bootstrap(fitted, w, rp, cp, n=60, method='residuals', processes=1, seed=1)
+    points = bootstrap(fitted, w, rp, cp, n=60, method='points', processes=1, seed=1)
+    ratio = residuals.std[0]/points.std[0] #the Debye strength follows the scatter of the f-sum target
+    assert 0.5 < ratio < 2
+
+
+def test_verbose_in_fit_options(fitted, noisy_spectrum):
+    (w, rp, cp) = noisy_spectrum
+    result = bootstrap(fitted, w, rp, cp, n=2, processes=1, seed=1, verbose=True)
+    assert result.samples.shape == (2, 6)